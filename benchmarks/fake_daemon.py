@@ -0,0 +1,219 @@
+""" In-process stand-in for IPFS daemon HTTP API, backed by in-memory blockstore.
+
+Implements only the `/api/v0` endpoints `ipfs-api-mount` uses. Every
+request can be delayed by configurable latency, to mimic real daemon
+(or network) behaviour, and requests are counted per endpoint.
+"""
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from ipfs_api_mount import merkledag_pb2, unixfs_pb2
+from ipfs_api_mount.cid import cid_from_str, cid_to_str
+
+SHA2_256 = bytes([0x12, 0x20])
+RAW_CID_PREFIX = bytes([0x01, 0x55])
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeDaemon:
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency  # seconds added to every request
+        self.jitter = jitter  # max random seconds added on top of latency
+        self.blocks = {}  # CID -> block
+        self.request_counts = Counter()
+        self.lock = threading.Lock()
+        self.server = None
+
+    # building DAGs
+
+    def add_raw(self, data):
+        cid = cid_to_str(RAW_CID_PREFIX + SHA2_256 + hashlib.sha256(data).digest())
+        self.blocks[cid] = data
+        return cid
+
+    def add_node(self, data, links=()):
+        """ Store dag-pb node, `links` are `(name, cid, size)` """
+        node = merkledag_pb2.PBNode()
+        node.Data = data.SerializeToString()
+        for name, cid, size in links:
+            node.Links.add(Hash=cid_from_str(cid), Name=name, Tsize=size)
+        block = node.SerializeToString()
+        cid = cid_to_str(SHA2_256 + hashlib.sha256(block).digest())
+        self.blocks[cid] = block
+        return cid
+
+    def add_file(self, content, chunk_size=256 * 1024, fanout=174):
+        """ Store balanced UnixFS file with raw leaves, returns its CID. """
+        nodes = [
+            (self.add_raw(content[i:(i + chunk_size)]), len(content[i:(i + chunk_size)]))
+            for i in range(0, len(content), chunk_size)
+        ]
+        if not nodes:
+            return self.add_raw(b'')
+        while len(nodes) > 1:
+            nodes = [
+                self._add_file_node(nodes[i:(i + fanout)])
+                for i in range(0, len(nodes), fanout)
+            ]
+        return nodes[0][0]
+
+    def _add_file_node(self, children):
+        size = sum(child_size for _, child_size in children)
+        data = unixfs_pb2.Data(
+            Type=unixfs_pb2.Data.File,
+            filesize=size,
+            blocksizes=[child_size for _, child_size in children],
+        )
+        return self.add_node(data, [('', cid, child_size) for cid, child_size in children]), size
+
+    def add_dir(self, entries):
+        """ Store UnixFS directory, `entries` maps names to CIDs. """
+        data = unixfs_pb2.Data(Type=unixfs_pb2.Data.Directory)
+        return self.add_node(data, [
+            (name, cid, len(self.blocks[cid]))
+            for name, cid in sorted(entries.items())
+        ])
+
+    # API
+
+    def resolve(self, path):
+        return {'Path': '/ipfs/' + self._walk(path)}
+
+    def ls(self, path):
+        cid = self._walk(path)
+        node, _ = self._decode(cid)
+        links = []
+        for link in node.Links:
+            link_cid = cid_to_str(link.Hash)
+            link_node, link_data = self._decode(link_cid)
+            if link_data is None:
+                link_type, size = unixfs_pb2.Data.File, len(self.blocks[link_cid])
+            elif link_data.Type == unixfs_pb2.Data.Directory:
+                link_type, size = unixfs_pb2.Data.Directory, 0
+            else:
+                link_type, size = link_data.Type, link_data.filesize
+            links.append({'Name': link.Name, 'Hash': link_cid, 'Size': size, 'Type': link_type})
+        return {'Objects': [{'Hash': cid, 'Links': links}]}
+
+    def block_get(self, cid):
+        if cid not in self.blocks:
+            raise NotFound(f'block {cid} not found')
+        return self.blocks[cid]
+
+    def block_stat(self, cid):
+        return {'Key': cid, 'Size': len(self.block_get(cid))}
+
+    def version(self, arg):
+        return {'Version': '0.8.0', 'Commit': '', 'Repo': '11', 'System': 'fake', 'Golang': ''}
+
+    def _walk(self, path):
+        parts = [part for part in path.split('/') if part]
+        if parts[:1] == ['ipfs']:
+            parts = parts[1:]
+        if not parts or parts[0] not in self.blocks:
+            raise NotFound(f'invalid path {path}')
+        cid = parts[0]
+        for name in parts[1:]:
+            node, _ = self._decode(cid)
+            for link in node.Links:
+                if link.Name == name:
+                    cid = cid_to_str(link.Hash)
+                    break
+            else:
+                raise NotFound(f'no link named {name} under {cid}')
+        return cid
+
+    def _decode(self, cid):
+        if cid_from_str(cid).startswith(RAW_CID_PREFIX):
+            return merkledag_pb2.PBNode(), None
+        node = merkledag_pb2.PBNode()
+        node.ParseFromString(self.blocks[cid])
+        data = unixfs_pb2.Data()
+        data.ParseFromString(node.Data)
+        return node, data
+
+    # HTTP
+
+    def start(self):
+        endpoints = {
+            'resolve': self.resolve,
+            'ls': self.ls,
+            'block/get': self.block_get,
+            'block/stat': self.block_stat,
+            'version': self.version,
+        }
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                endpoint = url.path[len('/api/v0/'):]
+                query = parse_qs(url.query)
+                arg = query.get('arg', [''])[0]
+                with daemon.lock:
+                    daemon.request_counts[endpoint] += 1
+                time.sleep(daemon.latency + random.uniform(0, daemon.jitter))
+
+                try:
+                    if endpoint not in endpoints:
+                        raise NotFound(f'unknown endpoint {endpoint}')
+                    result = endpoints[endpoint](arg)
+                except NotFound as e:
+                    status = 500
+                    body = json.dumps({'Message': str(e), 'Code': 0, 'Type': 'error'}).encode()
+                else:
+                    status = 200
+                    if isinstance(result, bytes):
+                        body = result
+                    elif endpoint == 'ls' and query.get('stream') == ['true']:
+                        # one entry per line, like the daemon streams them
+                        body = b''.join(
+                            json.dumps({'Objects': [{'Hash': obj['Hash'], 'Links': [link]}]}).encode() + b'\n'
+                            for obj in result['Objects']
+                            for link in obj['Links']
+                        )
+                    else:
+                        body = json.dumps(result).encode()
+
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            # client hanging up on a stream is fine
+            super().handle_error(request, client_address)
@@ -0,0 +1,425 @@
+""" Benchmark suite - mounts trees served by in-process fake daemon and measures filesystem operations.
+
+    python benchmarks/run.py --latency 0.005 --save-baseline baseline.json
+    python benchmarks/run.py --latency 0.005 --baseline baseline.json
+
+Exits with non-zero status when any metric got worse than in the baseline
+by more than allowed tolerance.
+
+With --direct FUSE operations are called in process instead of through a
+mount, so daemon request counts don't depend on the kernel. Such counts
+are stored in benchmarks/baseline.json:
+
+    python benchmarks/run.py --direct --latency 0 --baseline benchmarks/baseline.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import stat
+import statistics
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+import ipfshttpclient
+import pyfuse3
+import trio
+from fake_daemon import FakeDaemon
+
+from ipfs_api_mount import ipfs_mounted
+from ipfs_api_mount.async_client import AsyncIPFSClient, TrioIPFSClient
+from ipfs_api_mount.fuse_operations import IPFSOperations, WholeIPFSOperations
+
+MiB = 1024 * 1024
+SCENARIOS = {}
+
+
+def scenario(f):
+    SCENARIOS[f.__name__] = f
+    return f
+
+
+@scenario
+def sequential_read(bench):
+    content = bench.random_bytes(bench.scale * 32 * MiB)
+    root = bench.daemon.add_dir({'file': bench.daemon.add_file(content)})
+    with bench.mounted(root) as fs:
+        timings = []
+        f = fs.open('file')
+        try:
+            offset = 0
+            start = time.perf_counter()
+            while True:
+                op_start = time.perf_counter()
+                data = fs.pread(f, 128 * 1024, offset)
+                timings.append(time.perf_counter() - op_start)
+                if not data:
+                    break
+                offset += len(data)
+            duration = time.perf_counter() - start
+        finally:
+            fs.close(f)
+    return dict(throughput_mib_s=len(content) / MiB / duration, **latencies(timings))
+
+
+@scenario
+def random_read(bench):
+    content = bench.random_bytes(bench.scale * 32 * MiB)
+    root = bench.daemon.add_dir({'file': bench.daemon.add_file(content)})
+    rng = random.Random(0)
+    read_size = 4096
+    offsets = [rng.randrange(len(content) - read_size) for _ in range(bench.scale * 500)]
+    with bench.mounted(root) as fs:
+        timings = []
+        f = fs.open('file')
+        try:
+            start = time.perf_counter()
+            for offset in offsets:
+                op_start = time.perf_counter()
+                fs.pread(f, read_size, offset)
+                timings.append(time.perf_counter() - op_start)
+            duration = time.perf_counter() - start
+        finally:
+            fs.close(f)
+    return dict(throughput_mib_s=len(offsets) * read_size / MiB / duration, **latencies(timings))
+
+
+@scenario
+def list_wide_tree(bench):
+    root = bench.daemon.add_dir({
+        f'file{i}': bench.daemon.add_file(str(i).encode())
+        for i in range(bench.scale * 5000)
+    })
+    with bench.mounted(root) as fs:
+        return list_recursive(fs)
+
+
+@scenario
+def list_deep_tree(bench):
+    leaves = itertools.count()
+
+    def tree(depth):
+        if depth == 0:
+            return bench.daemon.add_file(str(next(leaves)).encode())
+        return bench.daemon.add_dir({f'entry{i}': tree(depth - 1) for i in range(4)})
+    root = tree(6 + bench.scale)  # 4^7 leaves by default
+    with bench.mounted(root) as fs:
+        return list_recursive(fs)
+
+
+@scenario
+def whole_mode_lookup(bench):
+    files = [bench.daemon.add_file(f'file {i}'.encode()) for i in range(bench.scale * 1000)]
+    root = bench.daemon.add_dir({f'file{i}': cid for i, cid in enumerate(files)})
+    paths = [f'{root}/file{i}' for i in range(len(files))] + files
+    with bench.mounted(None) as fs:
+        timings = []
+        start = time.perf_counter()
+        for path in paths:
+            op_start = time.perf_counter()
+            fs.stat(path)
+            timings.append(time.perf_counter() - op_start)
+        duration = time.perf_counter() - start
+    return dict(ops_s=len(paths) / duration, **latencies(timings))
+
+
+@scenario
+def repeated_getattr(bench):
+    root = bench.daemon.add_dir({
+        f'dir{i}': bench.daemon.add_dir({'file': bench.daemon.add_file(str(i).encode())})
+        for i in range(bench.scale * 100)
+    })
+    paths = [f'dir{i}' for i in range(bench.scale * 100)]
+    with bench.mounted(root) as fs:
+        for path in paths:
+            fs.stat(path)
+        timings = []
+        start = time.perf_counter()
+        for _ in range(100):
+            for path in paths:
+                op_start = time.perf_counter()
+                fs.getattr(path)
+                timings.append(time.perf_counter() - op_start)
+        duration = time.perf_counter() - start
+    return dict(ops_s=len(timings) / duration, **latencies(timings))
+
+
+def list_recursive(fs):
+    """ Equivalent of `ls -lR` - list every directory and stat every entry. """
+    timings = []
+    start = time.perf_counter()
+    for dir_path, dir_names, file_names in fs.walk():
+        for name in dir_names + file_names:
+            op_start = time.perf_counter()
+            fs.stat(os.path.join(dir_path, name))
+            timings.append(time.perf_counter() - op_start)
+    duration = time.perf_counter() - start
+    return dict(ops_s=len(timings) / duration, **latencies(timings))
+
+
+def latencies(timings):
+    quantiles = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'p50_ms': quantiles[49] * 1000,
+        'p90_ms': quantiles[89] * 1000,
+        'p99_ms': quantiles[98] * 1000,
+    }
+
+
+class MountedFS:
+    """ Files of mounted filesystem, paths relative to the mountpoint. """
+
+    def __init__(self, mountpoint):
+        self.mountpoint = mountpoint
+
+    def stat(self, path):
+        return os.lstat(os.path.join(self.mountpoint, path))
+
+    def getattr(self, path):
+        # the kernel may answer from its own cache
+        return os.lstat(os.path.join(self.mountpoint, path))
+
+    def walk(self):
+        for dir_path, dir_names, file_names in os.walk(self.mountpoint):
+            yield os.path.relpath(dir_path, self.mountpoint), dir_names, file_names
+
+    def open(self, path):
+        return os.open(os.path.join(self.mountpoint, path), os.O_RDONLY)
+
+    def pread(self, fd, size, offset):
+        return os.pread(fd, size, offset)
+
+    def close(self, fd):
+        os.close(fd)
+
+
+class DirectFS:
+    """ The same as `MountedFS`, but calling FUSE operations in process,
+    without a mount. There is no kernel in between - no page cache or
+    kernel read-ahead, names and attributes are remembered forever - so
+    the daemon requests made don't depend on the machine. """
+
+    def __init__(self, operations):
+        self.operations = operations
+        self.entries = {'.': None}  # path -> `EntryAttributes`, like kernel's dentry cache
+        self.trio_token = None
+        self.stopped = None
+        self.thread = None
+        # the real one works only with tokens passed by libfuse
+        self.readdir_reply = mock.patch.object(pyfuse3, 'readdir_reply', side_effect=_readdir_reply)
+
+    def __enter__(self):
+        self.readdir_reply.start()
+        started = threading.Event()
+
+        async def loop():
+            self.trio_token = trio.lowlevel.current_trio_token()
+            self.stopped = trio.Event()
+            started.set()
+            await self.stopped.wait()
+
+        self.thread = threading.Thread(target=trio.run, args=(loop,), daemon=True)
+        self.thread.start()
+        started.wait()
+        self.entries['.'] = self._call(self.operations.getattr, pyfuse3.ROOT_INODE, None)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        trio.from_thread.run_sync(self.stopped.set, trio_token=self.trio_token)
+        self.thread.join()
+        self.readdir_reply.stop()
+
+    def stat(self, path):
+        attrs = self._lookup(os.path.normpath(path))
+        if attrs.st_ino == 0:
+            raise FileNotFoundError(path)
+        return attrs
+
+    def getattr(self, path):
+        return self._call(self.operations.getattr, self.stat(path).st_ino, None)
+
+    def walk(self):
+        pending = ['.']
+        while pending:
+            dir_path = pending.pop()
+            dir_names, file_names = [], []
+            for name, attrs in self._listdir(dir_path):
+                self.entries[os.path.normpath(os.path.join(dir_path, name))] = attrs
+                (dir_names if stat.S_ISDIR(attrs.st_mode) else file_names).append(name)
+            yield dir_path, dir_names, file_names
+            pending.extend(os.path.join(dir_path, name) for name in reversed(dir_names))
+
+    def open(self, path):
+        return self._call(self.operations.open, self.stat(path).st_ino, os.O_RDONLY, None).fh
+
+    def pread(self, fh, size, offset):
+        return self._call(self.operations.read, fh, offset, size)
+
+    def close(self, fh):
+        self._call(self.operations.release, fh)
+
+    def _lookup(self, path):
+        attrs = self.entries.get(path)
+        if attrs is None:
+            parent_path, name = os.path.split(path)
+            parent = self._lookup(parent_path or '.')
+            attrs = self._call(self.operations.lookup, parent.st_ino, name.encode(), None)
+            self.entries[path] = attrs
+        return attrs
+
+    def _listdir(self, path):
+        fh = self._call(self.operations.opendir, self.stat(path).st_ino, None)
+        try:
+            entries = []
+            self._call(self.operations.readdir, fh, 0, entries)
+            return entries
+        finally:
+            self._call(self.operations.releasedir, fh)
+
+    def _call(self, fn, *args):
+        return trio.from_thread.run(fn, *args, trio_token=self.trio_token)
+
+
+def _readdir_reply(token, name, attrs, next_id):
+    token.append((name.decode(), attrs))
+    return True
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.scale = args.scale
+        self.api_client = args.api_client
+        self.mount_kwargs = dict(threads=args.threads)
+        self.direct = args.direct
+        self.daemon = FakeDaemon(latency=args.latency, jitter=args.jitter)
+
+    def random_bytes(self, n):
+        return random.Random(n).getrandbits(n * 8).to_bytes(n, 'little')
+
+    @contextmanager
+    def mounted(self, root):
+        """ Serve given root (whole IPFS if `None`), yield `MountedFS` or `DirectFS`. """
+        host, port = self.daemon.server.server_address
+        if self.api_client == 'async':
+            client = TrioIPFSClient(AsyncIPFSClient(f'http://{host}:{port}/api/v0'))
+        else:
+            client = ipfshttpclient.connect(f'/ip4/{host}/tcp/{port}/http')
+        self.daemon.request_counts.clear()
+        if root is None:
+            operations = WholeIPFSOperations(client, **self.mount_kwargs)
+        else:
+            operations = IPFSOperations(root, client, **self.mount_kwargs)
+        if self.direct:
+            with DirectFS(operations) as fs:
+                yield fs
+        else:
+            with ipfs_mounted(operations) as mountpoint:
+                yield MountedFS(mountpoint)
+
+    def run(self, name):
+        result = SCENARIOS[name](self)
+        counts = self.daemon.request_counts
+        counts.pop('version', None)  # connection check, not filesystem work
+        result['requests'] = sum(counts.values())
+        result['requests_by_endpoint'] = dict(counts)
+        return result
+
+
+# metric name suffix -> True if higher is better
+METRIC_DIRECTIONS = {
+    '_mib_s': True,
+    'ops_s': True,
+    '_ms': False,
+    'requests': False,
+}
+
+
+def regressions(results, baseline, tolerance):
+    """ Iterate over `(scenario, metric, value, baseline value)` which got worse than tolerated. """
+    for name, result in results.items():
+        for metric, value in result.items():
+            baseline_value = baseline.get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or baseline_value is None:
+                continue
+            higher_is_better = next(
+                direction
+                for suffix, direction in METRIC_DIRECTIONS.items()
+                if metric.endswith(suffix)
+            )
+            if higher_is_better:
+                worse = value < baseline_value * (1 - tolerance)
+            else:
+                worse = value > baseline_value * (1 + tolerance)
+            if worse:
+                yield name, metric, value, baseline_value
+
+
+def print_result(name, result, baseline):
+    print(name)
+    for metric, value in result.items():
+        if isinstance(value, dict):
+            value = ', '.join(f'{k}={v}' for k, v in sorted(value.items()))
+            print(f'    {metric:22} {value}')
+            continue
+        line = f'    {metric:22} {value:12.2f}'
+        if metric in baseline:
+            line += f'    (baseline {baseline[metric]:.2f})'
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help='scenarios to run, any of: {} (default: all)'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds added to every daemon request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds added on top of latency')
+    parser.add_argument('--scale', type=int, default=1, help='multiplies size of test data')
+    parser.add_argument('--threads', type=int, default=16, help='passed to mounted filesystem')
+    parser.add_argument('--api-client', choices=['ipfshttpclient', 'async'], default='ipfshttpclient')
+    parser.add_argument('--direct', action='store_true', help='call filesystem operations in process, without mounting')
+    parser.add_argument('--baseline', help='JSON file with results to compare against')
+    parser.add_argument('--save-baseline', help='store results as JSON in given file')
+    parser.add_argument('--save-requests-only', action='store_true',
+                        help='store only request counts - unlike timings they don\'t depend on the machine')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative worsening of any metric (default: %(default)s)')
+    args = parser.parse_args(argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario {name}')
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    bench = Benchmark(args)
+    with bench.daemon:
+        for name in args.scenarios or SCENARIOS:
+            results[name] = bench.run(name)
+            print_result(name, results[name], baseline.get(name, {}))
+
+    if args.save_baseline:
+        saved = results
+        if args.save_requests_only:
+            saved = {
+                name: {metric: value for metric, value in result.items() if metric.startswith('requests')}
+                for name, result in results.items()
+            }
+        with open(args.save_baseline, 'w') as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    failed = list(regressions(results, baseline, args.tolerance))
+    for name, metric, value, baseline_value in failed:
+        print(f'REGRESSION {name} {metric}: {value:.2f} (baseline {baseline_value:.2f})', file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import functools
+import json
+import logging
+import threading
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import httpx
+import ipfshttpclient
+import trio
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncIPFSClient:
+    """ Minimal asynchronous client for the part of `/api/v0` we use.
+    Requests share a pool of keep-alive connections. """
+
+    def __init__(
+        self,
+        base_url,  # like 'http://127.0.0.1:5001/api/v0'
+        max_connections=16,
+    ):
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self._http = None
+        self._http_trio_token = None
+
+    async def resolve(self, path, **kwargs):
+        return await self.request('/resolve', path, **kwargs)
+
+    async def ls(self, path, **kwargs):
+        return await self.request('/ls', path, **kwargs)
+
+    async def ls_stream(self, path, timeout=None, http=None):
+        """ Iterate over parts of `ls` result as the daemon streams them. """
+        if http is None:
+            http = await self._get_http()
+        async with self._translate_errors():
+            async with http.stream(
+                'POST',
+                self.base_url + '/ls',
+                params={'arg': path, 'stream': 'true'},
+                timeout=timeout,
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                    _raise_error_response(response)
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        try:
+                            yield json.loads(line)
+                        except ValueError as e:
+                            raise ipfshttpclient.exceptions.DecodingError('json', e) from e
+
+    async def object_data(self, cid, **kwargs):
+        return await self.request('/object/data', cid, decode_json=False, **kwargs)
+
+    async def object_links(self, cid, **kwargs):
+        return await self.request('/object/links', cid, **kwargs)
+
+    async def block_get(self, cid, **kwargs):
+        return await self.request('/block/get', cid, decode_json=False, **kwargs)
+
+    async def block_stat(self, cid, **kwargs):
+        return await self.request('/block/stat', cid, **kwargs)
+
+    async def version(self, **kwargs):
+        return await self.request('/version', None, **kwargs)
+
+    async def request(self, endpoint, arg, timeout=None, decode_json=True, http=None):
+        if http is None:
+            http = await self._get_http()
+        async with self._translate_errors():
+            response = await http.post(
+                self.base_url + endpoint,
+                params={} if arg is None else {'arg': arg},
+                timeout=timeout,
+            )
+
+        if response.is_error:
+            _raise_error_response(response)
+
+        if decode_json:
+            try:
+                return response.json()
+            except ValueError as e:
+                raise ipfshttpclient.exceptions.DecodingError('json', e) from e
+        return response.content
+
+    @asynccontextmanager
+    async def _translate_errors(self):
+        """ Raise `ipfshttpclient` exceptions instead of `httpx` ones. """
+        try:
+            yield
+        except httpx.TimeoutException as e:
+            raise ipfshttpclient.exceptions.TimeoutError(e) from e
+        except httpx.TransportError as e:
+            raise ipfshttpclient.exceptions.ConnectionError(e) from e
+
+    async def aclose(self):
+        """ Close the pool of connections. """
+        http = self._http
+        self._http = None
+        self._http_trio_token = None
+        if http is not None:
+            await _aclose_quietly(http)
+
+    async def _get_http(self):
+        # connection pool is bound to the event loop, so there is one per `trio.run()`
+        trio_token = trio.lowlevel.current_trio_token()
+        if self._http is None or self._http_trio_token is not trio_token:
+            previous_http = self._http
+            self._http = httpx.AsyncClient(limits=self.limits)
+            self._http_trio_token = trio_token
+            if previous_http is not None:
+                # left by a finished event loop, its connections would stay open
+                await _aclose_quietly(previous_http)
+        return self._http
+
+
+async def _aclose_quietly(http):
+    with trio.CancelScope(shield=True):
+        try:
+            await http.aclose()
+        except Exception:
+            logger.debug('closing connection pool failed', exc_info=True)
+
+
+def _raise_error_response(response):
+    try:
+        message = response.json()['Message']
+    except (ValueError, KeyError, TypeError):
+        message = response.text
+    raise ipfshttpclient.exceptions.ErrorResponse(message, None)
+
+
+class TrioIPFSClient:
+    """ Blocking facade over `AsyncIPFSClient`, mimicking the parts of
+    `ipfshttpclient` client used by `CachedIPFS`.
+
+    Called from trio worker threads it runs requests on the event loop, so
+    all of them share one connection pool. Called from other threads it
+    uses the event loop seen in worker threads, if it's still running, or
+    makes a one-off request in a private event loop. """
+
+    def __init__(self, async_client):
+        self.async_client = async_client
+        self.object = SimpleNamespace(
+            data=self._blocking(async_client.object_data),
+            links=self._blocking(async_client.object_links),
+        )
+        self.block = SimpleNamespace(
+            get=self._blocking(async_client.block_get),
+            stat=self._blocking(async_client.block_stat),
+        )
+        self.resolve = self._blocking(async_client.resolve)
+        self._version = self._blocking(lambda _, **kwargs: async_client.version(**kwargs))
+        self._ls = self._blocking(async_client.ls)
+        self._thread_local = threading.local()
+        self._trio_token = None  # of the event loop seen in worker threads
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the pool has to be closed by an event loop, the one using it if it still runs
+        if self._trio_token is not None:
+            try:
+                trio.from_thread.run(self.async_client.aclose, trio_token=self._trio_token)
+                return
+            except trio.RunFinishedError:
+                pass
+        trio.run(self.async_client.aclose)
+
+    def ls(self, path, timeout=None, stream=False, opts=None):
+        """ With `stream` returns an iterator over parts of the result, as they come.
+        `opts` is accepted for compatibility with `ipfshttpclient` - daemon-side
+        streaming is always requested when streaming. """
+        if stream:
+            return self._blocking_stream(self.async_client.ls_stream, path, timeout)
+        return self._ls(path, timeout=timeout)
+
+    def version(self, timeout=None):
+        return self._version(None, timeout=timeout)
+
+    def _blocking_stream(self, async_gen_fn, arg, timeout):
+        if not self._in_trio_thread():
+            yield from trio.run(self._one_off_stream, async_gen_fn, arg, timeout)
+            return
+
+        # async generator is consumed by a single task, passing items through a channel
+        send_channel, receive_channel = trio.open_memory_channel(0)
+        trio.from_thread.run_sync(
+            trio.lowlevel.spawn_system_task,
+            self._produce_stream, async_gen_fn, arg, timeout, send_channel,
+        )
+        try:
+            while True:
+                try:
+                    item, error = trio.from_thread.run(receive_channel.receive)
+                except trio.EndOfChannel:
+                    return
+                if error is not None:
+                    raise error
+                yield item
+        finally:
+            try:
+                trio.from_thread.run(receive_channel.aclose)
+            except RuntimeError:
+                # closed outside of trio thread (garbage collected) - the producer stops on its own
+                pass
+
+    async def _produce_stream(self, async_gen_fn, arg, timeout, send_channel):
+        items = async_gen_fn(arg, timeout=timeout)
+        async with send_channel:
+            try:
+                async for item in items:
+                    await send_channel.send((item, None))
+            except (trio.BrokenResourceError, trio.ClosedResourceError):
+                # consumer is gone
+                pass
+            except Exception as e:
+                try:
+                    await send_channel.send((None, e))
+                except (trio.BrokenResourceError, trio.ClosedResourceError):
+                    pass
+            finally:
+                await items.aclose()
+
+    async def _one_off_stream(self, async_gen_fn, arg, timeout):
+        async with httpx.AsyncClient() as http:
+            return [item async for item in async_gen_fn(arg, timeout=timeout, http=http)]
+
+    def _blocking(self, async_fn):
+        def f(arg, timeout=None):
+            request = functools.partial(async_fn, arg, timeout=timeout)
+            if self._in_trio_thread():
+                return trio.from_thread.run(request)
+            trio_token = self._trio_token
+            if trio_token is not None:
+                # thread not started by trio (like hedged requests), but the event loop is known
+                try:
+                    return trio.from_thread.run(request, trio_token=trio_token)
+                except trio.RunFinishedError:
+                    self._trio_token = None
+            return trio.run(self._one_off_request, async_fn, arg, timeout)
+        return f
+
+    async def _one_off_request(self, async_fn, arg, timeout):
+        async with httpx.AsyncClient() as http:
+            return await async_fn(arg, timeout=timeout, http=http)
+
+    def _in_trio_thread(self):
+        in_trio_thread = getattr(self._thread_local, 'in_trio_thread', None)
+        if in_trio_thread is None:
+            try:
+                trio.from_thread.run_sync(lambda: None)
+            except RuntimeError:
+                in_trio_thread = False
+            else:
+                in_trio_thread = True
+                self._trio_token = trio.from_thread.run_sync(trio.lowlevel.current_trio_token)
+            self._thread_local.in_trio_thread = in_trio_thread
+        return in_trio_thread
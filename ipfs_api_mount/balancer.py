@@ -0,0 +1,183 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+import ipfshttpclient
+import mmh3
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('least-requests', 'hash')
+
+
+@dataclass(eq=False)
+class Endpoint:
+    name: str
+    client: object
+    in_flight: int = 0
+    failures: int = 0  # consecutive failed requests
+    healthy: bool = True
+
+
+class BalancedClient:
+    """ Spreads requests over many daemons, mimicking the parts of
+    `ipfshttpclient` client used by `CachedIPFS`.
+
+    With 'least-requests' strategy a request goes to the endpoint with the
+    fewest requests in progress. With 'hash' it goes to the endpoint chosen
+    by rendezvous hashing of the CID, so every daemon keeps getting the same
+    part of the content and its own caches stay warm.
+
+    An endpoint failing `max_failures` requests in a row (connection errors
+    and timeouts) is ejected. Requests which couldn't connect are repeated
+    on another endpoint. Every `health_check_interval` seconds each endpoint
+    is asked for its version - the ones answering within
+    `health_check_timeout` are (re-)admitted, the rest are ejected. When all
+    endpoints are ejected, requests are sent to all of them anyway. """
+
+    def __init__(
+        self,
+        clients,  # {name: client}, like {'127.0.0.1:5001': ipfshttpclient.connect(...)}
+        strategy='least-requests',
+        max_failures=3,
+        health_check_interval=5.0,  # in seconds, None disables health checks
+        health_check_timeout=2.0,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'unknown strategy {strategy!r}')
+        self.endpoints = [Endpoint(name=name, client=client) for name, client in clients.items()]
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.health_check_timeout = health_check_timeout
+        self.lock = threading.Lock()
+        self.turn = 0
+
+        self.block = SimpleNamespace(
+            get=lambda cid, **kwargs: self._call(cid, lambda c: c.block.get, cid, **kwargs),
+            stat=lambda cid, **kwargs: self._call(cid, lambda c: c.block.stat, cid, **kwargs),
+        )
+
+        self._exit_stack = ExitStack()
+        self._stopped = threading.Event()
+        if health_check_interval is not None:
+            threading.Thread(
+                target=self._health_check_loop, args=(health_check_interval,),
+                daemon=True,
+            ).start()
+
+    def __enter__(self):
+        for endpoint in self.endpoints:
+            self._exit_stack.enter_context(endpoint.client)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._exit_stack.close()
+
+    def resolve(self, path, **kwargs):
+        return self._call(path, lambda c: c.resolve, path, **kwargs)
+
+    def ls(self, path, stream=False, **kwargs):
+        if stream:
+            return self._ls_stream(path, **kwargs)
+        return self._call(path, lambda c: c.ls, path, **kwargs)
+
+    def _ls_stream(self, path, **kwargs):
+        # only the request itself fails over, not the rest of a started stream
+        responses, first_response = self._call(path, lambda c: functools.partial(_open_stream, c.ls), path, stream=True, **kwargs)
+        try:
+            if first_response is not None:
+                yield first_response
+                yield from responses
+        finally:
+            if hasattr(responses, 'close'):
+                responses.close()
+
+    def _call(self, path, method, *args, **kwargs):
+        key = _content_key(path)
+        tried = []
+        while True:
+            endpoint = self._choose(key, tried)
+            tried.append(endpoint)
+            try:
+                with self._tracked(endpoint):
+                    return method(endpoint.client)(*args, **kwargs)
+            except ipfshttpclient.exceptions.ConnectionError:
+                if len(tried) == len(self.endpoints):
+                    raise
+                logger.info('request to %s failed, trying another endpoint', endpoint.name)
+
+    def _choose(self, key, tried):
+        with self.lock:
+            candidates = [e for e in self.endpoints if e.healthy and e not in tried]
+            if not candidates:
+                candidates = [e for e in self.endpoints if e not in tried]
+
+            if self.strategy == 'hash' and key is not None:
+                return max(candidates, key=lambda e: mmh3.hash64(f'{e.name}/{key}', signed=False)[0])
+            # rotate, so ties are broken round-robin
+            self.turn += 1
+            start = self.turn % len(candidates)
+            return min(candidates[start:] + candidates[:start], key=lambda e: e.in_flight)
+
+    @contextmanager
+    def _tracked(self, endpoint):
+        with self.lock:
+            endpoint.in_flight += 1
+        try:
+            yield
+        except (ipfshttpclient.exceptions.ConnectionError, ipfshttpclient.exceptions.TimeoutError):
+            with self.lock:
+                endpoint.failures += 1
+                if endpoint.healthy and endpoint.failures >= self.max_failures:
+                    endpoint.healthy = False
+                    logger.warning('ejecting %s after %d failed requests', endpoint.name, endpoint.failures)
+            raise
+        else:
+            with self.lock:
+                endpoint.failures = 0
+        finally:
+            with self.lock:
+                endpoint.in_flight -= 1
+
+    def _health_check_loop(self, interval):
+        while not self._stopped.wait(interval):
+            for endpoint in self.endpoints:
+                self._health_check(endpoint)
+
+    def _health_check(self, endpoint):
+        start = time.perf_counter()
+        try:
+            endpoint.client.version(timeout=self.health_check_timeout)
+            healthy = time.perf_counter() - start < self.health_check_timeout
+        except Exception:
+            logger.debug('health check of %s failed', endpoint.name, exc_info=True)
+            healthy = False
+
+        with self.lock:
+            if healthy and not endpoint.healthy:
+                logger.warning('re-admitting %s', endpoint.name)
+                endpoint.failures = 0
+            elif not healthy and endpoint.healthy:
+                logger.warning('ejecting %s, health check failed', endpoint.name)
+            endpoint.healthy = healthy
+
+
+def _open_stream(ls, *args, **kwargs):
+    """ Start streamed `ls`, returning the responses and the first of them.
+    Some clients (like `TrioIPFSClient`) make the request only when the
+    responses are iterated - this way it's made within `_call()`. """
+    responses = ls(*args, **kwargs)
+    return responses, next(iter(responses), None)
+
+
+def _content_key(path):
+    """ CID a request is about - the first component of its path. """
+    for part in path.split('/'):
+        if part and part != 'ipfs':
+            return part
+    return None
@@ -0,0 +1,223 @@
+import logging
+import mmap
+import os
+import struct
+
+import ipfshttpclient
+
+from . import merkledag_pb2, unixfs_pb2
+from .cid import (RAW, cid_length, cid_multihash, cid_to_str, parse_cid,
+                  read_varint)
+
+logger = logging.getLogger(__name__)
+
+
+CARV2_PRAGMA = bytes.fromhex('0aa16776657273696f6e02')
+CARV2_HEADER = struct.Struct('<16sQQQ')  # characteristics, data offset, data size, index offset
+
+
+class CarClient:
+    """ Serves blocks straight from CAR files, mimicking the parts of
+    `ipfshttpclient` client used by `CachedIPFS`. No daemon needed.
+
+    Blocks are found through an index from multihash to position in a file,
+    built by scanning the files. With `save_index` the index is stored
+    next to every CAR file and loaded on the next start. """
+
+    def __init__(self, paths, save_index=False):
+        self.maps = []
+        self.index = {}  # multihash -> (map number, offset, length)
+        for path in paths:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            map_number = len(self.maps)
+            self.maps.append(mapped)
+            for multihash, offset, length in self._file_index(path, mapped, save_index):
+                self.index[multihash] = (map_number, offset, length)
+
+        self.block = _CarBlockAPI(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def get_block(self, cid):
+        try:
+            parsed = parse_cid(cid)
+        except ValueError as e:
+            raise ipfshttpclient.exceptions.ErrorResponse(f'invalid cid {cid}', e)
+        if parsed.is_inline:
+            return parsed.digest
+        multihash = parsed.multihash
+        if multihash not in self.index:
+            raise ipfshttpclient.exceptions.ErrorResponse(f'block {cid} not found in CAR files', None)
+        map_number, offset, length = self.index[multihash]
+        return memoryview(self.maps[map_number])[offset:(offset + length)]
+
+    def resolve(self, path, **kwargs):
+        return {'Path': '/ipfs/' + self._resolve(path)}
+
+    def ls(self, path, stream=False, **kwargs):
+        cid = self._resolve(path)
+        if stream:
+            return self._ls_stream(cid)
+        return {'Objects': [{
+            'Hash': cid,
+            'Links': [
+                self._ls_entry(name, child_cid)
+                for name, child_cid in self._dir_entries(cid)
+            ],
+        }]}
+
+    def _ls_stream(self, cid):
+        # one entry per part, like the daemon does
+        for name, child_cid in self._dir_entries(cid):
+            yield {'Objects': [{'Hash': cid, 'Links': [self._ls_entry(name, child_cid)]}]}
+
+    def _resolve(self, path):
+        parts = [part for part in path.split('/') if part]
+        if parts[:1] == ['ipfs']:
+            parts = parts[1:]
+        elif parts[:1] == ['ipns']:
+            raise ipfshttpclient.exceptions.ErrorResponse('IPNS is not available without daemon', None)
+        if not parts:
+            raise ipfshttpclient.exceptions.ErrorResponse(f'invalid path {path}', None)
+
+        cid = parts[0]
+        self.get_block(cid)  # check if it exists
+        for name in parts[1:]:
+            for entry_name, entry_cid in self._dir_entries(cid):
+                if entry_name == name:
+                    cid = entry_cid
+                    break
+            else:
+                raise ipfshttpclient.exceptions.ErrorResponse(f'no link named {name} under {cid}', None)
+        return cid
+
+    def _dir_entries(self, cid):
+        """ Iterate over `(name, cid)` of directory entries, walking HAMT shards if needed. """
+        node, data = self._decode(cid)
+        if data is None or data.Type not in (unixfs_pb2.Data.Directory, unixfs_pb2.Data.HAMTShard):
+            raise ipfshttpclient.exceptions.ErrorResponse(f'{cid} is not a directory', None)
+
+        if data.Type == unixfs_pb2.Data.Directory:
+            for link in node.Links:
+                yield link.Name, cid_to_str(link.Hash)
+
+        else:
+            # shard links are named by hex prefix, followed by entry name (no name for subshards)
+            prefix_length = len('{:X}'.format(data.fanout - 1))
+            for link in node.Links:
+                if len(link.Name) == prefix_length:
+                    yield from self._dir_entries(cid_to_str(link.Hash))
+                else:
+                    yield link.Name[prefix_length:], cid_to_str(link.Hash)
+
+    def _ls_entry(self, name, cid):
+        node, data = self._decode(cid)
+        if data is None:
+            entry_type = unixfs_pb2.Data.File
+            size = len(self.get_block(cid))
+        elif data.Type in (unixfs_pb2.Data.Directory, unixfs_pb2.Data.HAMTShard):
+            entry_type = unixfs_pb2.Data.Directory
+            size = 0
+        else:
+            entry_type = data.Type
+            size = data.filesize
+        return {'Name': name, 'Hash': cid, 'Size': size, 'Type': entry_type}
+
+    def _decode(self, cid):
+        """ Decode dag-pb node and its UnixFS data. Both are `None` for raw blocks. """
+        if parse_cid(cid).codec == RAW:
+            return None, None
+        node = merkledag_pb2.PBNode()
+        node.ParseFromString(bytes(self.get_block(cid)))
+        data = unixfs_pb2.Data()
+        data.ParseFromString(node.Data)
+        return node, data
+
+    def _file_index(self, path, mapped, save_index):
+        index_path = path + '.index'
+        s = os.stat(path)
+        try:
+            return _load_index(index_path, s)
+        except (OSError, ValueError, struct.error):
+            pass
+
+        logger.info('indexing %s', path)
+        index = list(_scan(mapped))
+        if save_index:
+            _save_index(index_path, s, index)
+        return index
+
+
+class _CarBlockAPI:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, cid, **kwargs):
+        return self.client.get_block(cid)
+
+    def stat(self, cid, **kwargs):
+        return {'Key': cid, 'Size': len(self.client.get_block(cid))}
+
+
+def _scan(mapped):
+    """ Iterate over `(multihash, offset, length)` of blocks in CAR file. """
+    if mapped[:len(CARV2_PRAGMA)] == CARV2_PRAGMA:
+        # v2 is a wrapper around v1 payload
+        _, offset, size, _ = CARV2_HEADER.unpack_from(mapped, len(CARV2_PRAGMA))
+        end = offset + size
+    else:
+        offset = 0
+        end = len(mapped)
+
+    # skip header - we don't need roots
+    header_length, offset = read_varint(mapped, offset)
+    offset += header_length
+
+    while offset < end:
+        section_length, offset = read_varint(mapped, offset)
+        if section_length == 0:
+            # zero padding at the end of v2 payload
+            break
+        cid_end = offset + cid_length(mapped, offset)
+        yield cid_multihash(mapped[offset:cid_end]), cid_end, offset + section_length - cid_end
+        offset += section_length
+
+
+INDEX_HEADER = struct.Struct('<8sQQ')  # magic, CAR size, CAR mtime
+INDEX_MAGIC = b'IAMCARI1'
+INDEX_RECORD = struct.Struct('<BQQ')  # multihash length, offset, length
+
+
+def _load_index(index_path, car_stat):
+    with open(index_path, 'rb') as f:
+        data = f.read()
+    magic, size, mtime = INDEX_HEADER.unpack_from(data)
+    if (magic, size, mtime) != (INDEX_MAGIC, car_stat.st_size, car_stat.st_mtime_ns):
+        raise ValueError('stale index')
+
+    index = []
+    offset = INDEX_HEADER.size
+    while offset < len(data):
+        multihash_length, block_offset, block_length = INDEX_RECORD.unpack_from(data, offset)
+        offset += INDEX_RECORD.size
+        index.append((data[offset:(offset + multihash_length)], block_offset, block_length))
+        offset += multihash_length
+    return index
+
+
+def _save_index(index_path, car_stat, index):
+    tmp_path = index_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, car_stat.st_size, car_stat.st_mtime_ns))
+            for multihash, offset, length in index:
+                f.write(INDEX_RECORD.pack(len(multihash), offset, length))
+                f.write(multihash)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        logger.warning('failed to save index %s', index_path, exc_info=True)
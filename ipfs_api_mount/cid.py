@@ -0,0 +1,154 @@
+import base64
+import functools
+
+import multibase
+
+CID_V0_PREFIX = bytes([0x12, 0x20])  # sha2-256 multihash, 32 bytes long
+
+
+def cid_to_str(cid_bytes):
+    """ Encode binary CID the same way the daemon does: base58 for v0, base32 for v1. """
+    if len(cid_bytes) == 34 and cid_bytes.startswith(CID_V0_PREFIX):
+        return _base58_encode(cid_bytes)
+    return 'b' + base64.b32encode(cid_bytes).decode().lower().rstrip('=')
+
+
+def cid_from_str(cid):
+    """ Decode CID string into binary form. Raises ValueError for malformed CIDs. """
+    if cid.startswith('Qm'):
+        # v0 is base58 without multibase prefix
+        return _base58_decode(cid)
+    if cid.startswith('b'):
+        # the daemon's default for v1
+        encoded = cid[1:].upper()
+        return base64.b32decode(encoded + '=' * (-len(encoded) % 8))
+    return multibase.decode(cid)
+
+
+# standard codecs of `multibase` are pure python and slow, these two are hot
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_INDEX = {c: i for i, c in enumerate(BASE58_ALPHABET)}
+
+
+def _base58_encode(data):
+    n = int.from_bytes(data, 'big')
+    digits = []
+    while n:
+        n, digit = divmod(n, 58)
+        digits.append(BASE58_ALPHABET[digit])
+    zeros = len(data) - len(data.lstrip(b'\0'))
+    return '1' * zeros + ''.join(reversed(digits))
+
+
+def _base58_decode(string):
+    n = 0
+    try:
+        for c in string:
+            n = n * 58 + BASE58_INDEX[c]
+    except KeyError:
+        raise ValueError(f'invalid base58 string {string}')
+    zeros = len(string) - len(string.lstrip('1'))
+    return b'\0' * zeros + n.to_bytes((n.bit_length() + 7) // 8, 'big')
+
+
+def cid_length(buff, offset=0):
+    """ Get length of binary CID at given offset of a buffer. """
+    if buff[offset:(offset + 2)] == CID_V0_PREFIX:
+        return 34
+    end = offset
+    for _ in range(3):  # version, codec, multihash type
+        _, end = read_varint(buff, end)
+    digest_length, end = read_varint(buff, end)
+    return end + digest_length - offset
+
+
+def cid_multihash(cid_bytes):
+    """ Get multihash part of binary CID. Blocks with the same multihash have the same content. """
+    if len(cid_bytes) == 34 and cid_bytes.startswith(CID_V0_PREFIX):
+        return bytes(cid_bytes)
+    _, end = read_varint(cid_bytes)  # version
+    _, end = read_varint(cid_bytes, end)  # codec
+    return bytes(cid_bytes[end:])
+
+
+def read_varint(buff, offset=0):
+    """ Decode unsigned LEB128 varint. Returns the value and offset just past it. """
+    value = 0
+    shift = 0
+    while True:
+        byte = buff[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+# multicodec codes
+DAG_PB = 0x70
+RAW = 0x55
+DAG_CBOR = 0x71
+DAG_JSON = 0x0129
+LIBP2P_KEY = 0x72
+IDENTITY = 0x00  # multihash "function" keeping the data itself instead of its hash
+
+CODEC_NAMES = {
+    DAG_PB: 'dag-pb',
+    RAW: 'raw',
+    DAG_CBOR: 'dag-cbor',
+    DAG_JSON: 'dag-json',
+    LIBP2P_KEY: 'libp2p-key',
+}
+
+CID_CACHE_SIZE = 64 * 1024
+
+
+class CID:
+    """ Decoded CID. Get it with `parse_cid()`, which decodes every string only once. """
+
+    __slots__ = ('string', 'bytes', 'version', 'codec', 'hash_function', 'digest')
+
+    def __init__(self, string, cid_bytes):
+        self.string = string
+        self.bytes = cid_bytes
+        try:
+            if len(cid_bytes) == 34 and cid_bytes.startswith(CID_V0_PREFIX):
+                self.version, self.codec, self.hash_function = 0, DAG_PB, cid_bytes[0]
+                self.digest = cid_bytes[2:]
+                return
+            self.version, end = read_varint(cid_bytes)
+            self.codec, end = read_varint(cid_bytes, end)
+            self.hash_function, end = read_varint(cid_bytes, end)
+            digest_length, end = read_varint(cid_bytes, end)
+        except IndexError:
+            raise ValueError(f'truncated CID {string}')
+        if self.version != 1:
+            raise ValueError(f'unsupported CID version {self.version}')
+        self.digest = cid_bytes[end:]
+        if len(self.digest) != digest_length:
+            raise ValueError(f'bad digest length of CID {string}')
+
+    @property
+    def multihash(self):
+        return cid_multihash(self.bytes)
+
+    @property
+    def is_inline(self):
+        """ Block data is the digest itself, no need to fetch it. """
+        return self.hash_function == IDENTITY
+
+    @property
+    def codec_name(self):
+        return CODEC_NAMES.get(self.codec, hex(self.codec))
+
+    def __str__(self):
+        return self.string
+
+    def __repr__(self):
+        return f'CID({self.string!r})'
+
+
+@functools.lru_cache(maxsize=CID_CACHE_SIZE)
+def parse_cid(cid):
+    """ Decode CID string, memoized. Raises ValueError for malformed CIDs. """
+    return CID(cid, cid_from_str(cid))
@@ -1,14 +1,60 @@
 import argparse
 import logging
+import re
 import signal
 import socket
 import sys
+import threading
 
 import ipfshttpclient
 
 from . import __version__
-from .fuse_operations import IPFSOperations, WholeIPFSOperations
+from .async_client import AsyncIPFSClient, TrioIPFSClient
+from .balancer import STRATEGIES, BalancedClient
+from .car import CarClient
+from .fuse_operations import (IPFSOperations, MultiRootIPFSOperations,
+                              WholeIPFSOperations)
+from .fuse_operations.high import FOREVER
+from .ipfs import CachedIPFS
 from .ipfs_mounted import IPFSFUSEThread
+from .metrics import start_metrics_server
+from .prefetch import MODES as PREFETCH_MODES
+from .prefetch import Prefetcher, start_prefetch
+
+
+def size(value):
+    """ Parse size with optional binary unit suffix, like '64K' or '2G', into number of bytes. """
+    match = re.fullmatch(r'(\d+)([KMGT]?)(i?B)?', value.strip(), re.IGNORECASE)
+    if match is None:
+        raise argparse.ArgumentTypeError(f'invalid size: {value!r}')
+    number, unit, _ = match.groups()
+    return int(number) * 1024 ** ' KMGT'.index(unit.upper() or ' ')
+
+
+def endpoint_timeout(value):
+    """ Parse 'endpoint=seconds', like 'block/get=5'. """
+    endpoint, _, seconds = value.partition('=')
+    try:
+        return endpoint, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid endpoint timeout: {value!r}')
+
+
+def read_roots_file(path):
+    """ Read roots of multi-root mount - lines of 'name IPFS-path', '#' starts a comment. """
+    roots = {}
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.partition('#')[0].strip()
+            if not line:
+                continue
+            name, _, root = line.partition(' ')
+            if not root.strip():
+                raise ValueError(f'{path}:{line_number}: expected "name path", got {line!r}')
+            if name in roots:
+                raise ValueError(f'{path}:{line_number}: duplicate root name {name!r}')
+            roots[name] = root.strip()
+    return roots
 
 
 class Command:
@@ -21,15 +67,62 @@ class Command:
         raise NotImplementedError()
 
     def add_optional_arguments(self):
+        self.add_ipfs_arguments()
+        self.add_mount_arguments()
+
+    def add_ipfs_arguments(self):
+        """ Options of talking to IPFS and caching, common to all commands. """
         parser = self.parser
         parser.add_argument('--ls-cache-size', type=int, default=64, help='Max number of ls results kept in cache.')
         parser.add_argument('--block-cache-size', type=int, default=16, help='Max number of data blocks kept in cache.')
+        parser.add_argument('--block-cache-bytes', type=size, default=None, help='Max total size of data blocks kept in cache, like 512M or 2G. Overrides --block-cache-size.')
         parser.add_argument('--link-cache-size', type=int, default=256, help='Max number of object link sections kept in cache.')
+        parser.add_argument('--shard-cache-size', type=int, default=1024, help='Max number of sharded directory nodes kept in cache.')
         parser.add_argument('--attr-cache-size', type=int, default=1024 * 128, help='Max number of file attributes kept in cache.')
-        parser.add_argument('--allow-other', action='store_true', help='Set fuse mount option \'allow_other\'')
+        parser.add_argument('--disk-cache-dir', type=str, default=None, help='Directory for persistent cache of blocks. It survives remounts. Disabled by default.')
+        parser.add_argument('--disk-cache-bytes', type=size, default=1024 ** 3, help='Max total size of persistent block cache, like 512M or 20G.')
+        parser.add_argument(
+            '--snapshot-file', type=str, default=None,
+            help='File to save metadata caches (attributes, listings, resolved paths) in on exit. On start they are read from it as needed, so remounted FS is warm immediately. Disabled by default.',
+        )
+        parser.add_argument('--snapshot-interval', type=float, default=None, help='Also save metadata caches every this many seconds.')
+        parser.add_argument('--ipns-ttl', type=float, default=60.0, help='Seconds a resolved IPNS or DNSLink name is used before it\'s resolved again. Meanwhile the old result is used, so lookups don\'t wait for the resolution.')
+        parser.add_argument('--ipns-max-stale', type=float, default=24 * 60 * 60.0, help='Seconds past --ipns-ttl an old result of IPNS resolution may still be used. Lookups of names older than that wait for the resolution.')
         parser.add_argument('--api-host', type=str, default='127.0.0.1', help='IPFS API host')
         parser.add_argument('--api-port', type=int, default=5001, help='IPFS API port')
-        parser.add_argument('--timeout', type=float, default=30.0, help='Timeout for daemon requests, in seconds')
+        parser.add_argument(
+            '--api', dest='api_addresses', metavar='HOST:PORT', action='append', default=[],
+            help='IPFS API address, instead of --api-host and --api-port. May be given multiple times - requests are then spread over all daemons.',
+        )
+        parser.add_argument(
+            '--api-balance', choices=STRATEGIES, default='least-requests',
+            help='How requests are spread over many daemons. \'least-requests\' picks the one with fewest requests in progress, \'hash\' sends requests about the same CID to the same daemon.',
+        )
+        parser.add_argument(
+            '--car', dest='car_paths', metavar='CAR_FILE', action='append', default=[],
+            help='Serve blocks from given CAR file instead of IPFS daemon. May be given multiple times.',
+        )
+        parser.add_argument('--car-save-index', action='store_true', help='Save index of every CAR file next to it (as .index file), so the next start is faster.')
+        parser.add_argument(
+            '--api-client', choices=['ipfshttpclient', 'async'], default='ipfshttpclient',
+            help='Client used to talk to IPFS API. \'async\' makes requests from the event loop, over a pool of keep-alive connections.',
+        )
+        parser.add_argument('--timeout', type=float, default=30.0, help='Timeout for daemon requests, in seconds. Retries of a request have to fit in it too.')
+        parser.add_argument(
+            '--request-timeout', dest='request_timeouts', metavar='ENDPOINT=SECONDS', type=endpoint_timeout, action='append', default=[],
+            help='Timeout for requests to given API endpoint, like block/get=5, overriding --timeout. May be given multiple times.',
+        )
+        parser.add_argument('--retries', type=int, default=2, help='How many times a daemon request failing with timeout or connection error is repeated, as long as its timeout hasn\'t passed.')
+        parser.add_argument('--retry-backoff', type=float, default=0.1, help='Seconds to wait before the first retry. Doubled with every next one, with random jitter.')
+        parser.add_argument(
+            '--hedge-quantile', type=float, default=None,
+            help='Send a duplicate of a daemon request slower than this quantile of observed latency (like 0.95) and take the first answer. Disabled by default.',
+        )
+        parser.add_argument('--threads', type=int, default=16, help='Max number of daemon requests made concurrently (size of worker thread pool).')
+        parser.add_argument(
+            '--metrics-address', type=str, default=None,
+            help='Serve metrics in Prometheus format at given host:port or unix:/socket/path. Disabled by default.',
+        )
         parser.add_argument(
             "-l", "--log",
             dest='log', default=sys.stderr, type=argparse.FileType('w'),
@@ -42,10 +135,22 @@ class Command:
         )
         parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
 
+    def add_mount_arguments(self):
+        parser = self.parser
+        parser.add_argument('--read-ahead', type=size, default=1024 * 1024, help='Max number of bytes fetched in advance when a file is read sequentially. 0 disables read-ahead.')
+        parser.add_argument('--allow-other', action='store_true', help='Set fuse mount option \'allow_other\'')
+        parser.add_argument('--entry-timeout', type=float, default=FOREVER, help='Seconds the kernel may cache file names. Content is immutable, so by default it\'s practically forever.')
+        parser.add_argument('--attr-timeout', type=float, default=FOREVER, help='Seconds the kernel may cache file attributes. Practically forever by default.')
+        parser.add_argument('--negative-timeout', type=float, default=FOREVER, help='Seconds the kernel may remember that a name doesn\'t exist. Practically forever by default, 0 disables.')
+        parser.add_argument(
+            '--stats-file', type=str, default='.ipfs-api-mount-stats',
+            help='Name of hidden read-only file in mount root showing cache and request statistics. Empty string disables it.',
+        )
+
     def add_positional_arguments(self):
         self.parser.add_argument('mountpoint', type=str, help='Local mountpoint path.')
 
-    def run(self):
+    def parse_args(self):
         args = self.parser.parse_args()
 
         # Sets log level to WARN going more verbose for each new -v.
@@ -56,14 +161,16 @@ class Command:
         )
 
         logging.info('starting ipfs-api-mount %s with commandline %s', __version__, str(sys.argv))
+        return args
 
-        ip = socket.gethostbyname(args.api_host)
+    def run(self):
+        args = self.parse_args()
 
-        with ipfshttpclient.connect(
-            '/ip4/{}/tcp/{}/http'.format(ip, args.api_port)
-        ) as client:
+        with self.get_ipfs_client(args) as client:
             # we are not using it as a thread - just trigering mounting code localy
             operations = self.get_fuse_operations_instance(args, client)
+            if args.metrics_address:
+                start_metrics_server(args.metrics_address, operations.metrics)
             fuse_thread = IPFSFUSEThread(
                 args.mountpoint,
                 operations,
@@ -72,13 +179,67 @@ class Command:
             signal.signal(signal.SIGINT, lambda num, frame: fuse_thread.unmount(check=True))
             fuse_thread.mount()
 
-    def get_fuse_operations_kwargs(self, args):
+    def get_ipfs_client(self, args):
+        if args.car_paths:
+            return CarClient(args.car_paths, save_index=args.car_save_index)
+
+        addresses = args.api_addresses or ['{}:{}'.format(args.api_host, args.api_port)]
+        if len(addresses) == 1:
+            return self.get_api_client(args, addresses[0])
+        return BalancedClient(
+            {address: self.get_api_client(args, address, check=False) for address in addresses},
+            strategy=args.api_balance,
+        )
+
+    def get_api_client(self, args, address, check=True):
+        host, _, port = address.rpartition(':')
+        ip = socket.gethostbyname(host)
+        if args.api_client == 'async':
+            return TrioIPFSClient(AsyncIPFSClient(
+                'http://{}:{}/api/v0'.format(ip, port),
+                max_connections=args.threads,
+            ))
+        elif check:
+            return ipfshttpclient.connect(
+                '/ip4/{}/tcp/{}/http'.format(ip, port)
+            )
+        else:
+            # one of many daemons may be down at start, health checks will take care of it
+            return ipfshttpclient.Client(
+                '/ip4/{}/tcp/{}/http'.format(ip, port)
+            )
+
+    def get_ipfs_kwargs(self, args):
+        """ Arguments of `CachedIPFS`. """
         return dict(
             ls_cache_size=args.ls_cache_size,
             block_cache_size=args.block_cache_size,
+            block_cache_bytes=args.block_cache_bytes,
             link_cache_size=args.link_cache_size,
+            shard_cache_size=args.shard_cache_size,
+            disk_cache_dir=args.disk_cache_dir,
+            disk_cache_bytes=args.disk_cache_bytes,
+            snapshot_path=args.snapshot_file,
+            snapshot_interval=args.snapshot_interval,
+            ipns_ttl=args.ipns_ttl,
+            ipns_max_stale=args.ipns_max_stale,
             attr_cache_size=args.attr_cache_size,
             timeout=args.timeout,
+            request_timeouts=dict(args.request_timeouts),
+            retries=args.retries,
+            retry_backoff=args.retry_backoff,
+            hedge_quantile=args.hedge_quantile,
+        )
+
+    def get_fuse_operations_kwargs(self, args):
+        return dict(
+            threads=args.threads,
+            read_ahead=args.read_ahead,
+            stats_file=args.stats_file or None,
+            entry_timeout=args.entry_timeout,
+            attr_timeout=args.attr_timeout,
+            negative_timeout=args.negative_timeout,
+            **self.get_ipfs_kwargs(args),
         )
 
     def get_fuse_operations_instance(self, args):
@@ -93,20 +254,121 @@ class IPFSApiMountCommand(Command):
         self.parser.add_argument('root', type=str, help='Hash of IPFS dir to be mounted.')
         super().add_positional_arguments()
 
+    def add_optional_arguments(self):
+        super().add_optional_arguments()
+        self.parser.add_argument(
+            '--prefetch', choices=PREFETCH_MODES, default=None,
+            help='Walk the whole mounted directory in background, warming up caches. \'metadata\' fetches listings and attributes, \'data\' also content of files. See ipfs-api-mount-prefetch.',
+        )
+        self.parser.add_argument('--prefetch-bytes', type=size, default=None, help='Max total size of file data fetched by --prefetch data, like 10G. Unlimited by default.')
+        self.parser.add_argument(
+            '--prefetch-concurrency', type=int, default=4,
+            help='Max number of daemon requests made concurrently by --prefetch. They are made in addition to up to --threads requests of the filesystem itself, keep it low so reads aren\'t slowed down.',
+        )
+
     def get_fuse_operations_instance(self, args, ipfs_client):
-        return IPFSOperations(
+        operations = IPFSOperations(
             args.root,
             ipfs_client,
             **self.get_fuse_operations_kwargs(args),
         )
+        if args.prefetch:
+            start_prefetch(
+                operations.ipfs, operations.root_cid,
+                mode=args.prefetch,
+                concurrency=args.prefetch_concurrency,
+                max_bytes=args.prefetch_bytes,
+            )
+        return operations
 
 
 class IPFSApiMountWholeCommand(Command):
     def get_description(self):
         return 'Mount whole IPFS namespace in local directory.'
 
+    def add_optional_arguments(self):
+        super().add_optional_arguments()
+        self.parser.add_argument('--root-entry-timeout', type=float, default=60.0, help='Seconds the kernel may cache IPNS and DNSLink names in mount root, as they are mutable. CIDs are cached for --entry-timeout.')
+        self.parser.add_argument('--root-negative-timeout', type=float, default=10.0, help='Seconds the kernel may remember that a name in mount root doesn\'t exist. Missing content may show up later.')
+
     def get_fuse_operations_instance(self, args, ipfs_client):
         return WholeIPFSOperations(
             ipfs_client,
+            root_entry_timeout=args.root_entry_timeout,
+            root_negative_timeout=args.root_negative_timeout,
+            **self.get_fuse_operations_kwargs(args),
+        )
+
+
+class IPFSApiMountMultiCommand(Command):
+    def get_description(self):
+        return 'Mount many IPFS directories, listed in a file, as subdirectories of one local directory. They share caches and daemon connections.'
+
+    def add_optional_arguments(self):
+        super().add_optional_arguments()
+        self.parser.add_argument('--root-entry-timeout', type=float, default=60.0, help='Seconds the kernel may cache names in mount root. Roots may change when the roots file is reloaded.')
+
+    def add_positional_arguments(self):
+        self.parser.add_argument('roots_file', type=str, help='File with a line \'name IPFS-path\' for every directory to be mounted. Reloaded on SIGHUP.')
+        super().add_positional_arguments()
+
+    def get_fuse_operations_instance(self, args, ipfs_client):
+        operations = MultiRootIPFSOperations(
+            read_roots_file(args.roots_file),
+            ipfs_client,
+            root_entry_timeout=args.root_entry_timeout,
             **self.get_fuse_operations_kwargs(args),
         )
+
+        def reload():
+            try:
+                operations.set_roots(read_roots_file(args.roots_file))
+            except Exception:
+                logging.exception('failed to reload %s, keeping current roots', args.roots_file)
+            else:
+                logging.info('reloaded %s', args.roots_file)
+
+        # resolving roots takes daemon requests, keep them out of the event loop
+        signal.signal(signal.SIGHUP, lambda num, frame: threading.Thread(target=reload, daemon=True).start())
+        return operations
+
+
+class IPFSApiPrefetchCommand(Command):
+    def get_description(self):
+        return 'Walk IPFS directory, fetching everything under it, to warm up caches (disk cache and the daemon\'s own) before mounting.'
+
+    def add_optional_arguments(self):
+        self.add_ipfs_arguments()
+        parser = self.parser
+        parser.add_argument('--mode', choices=PREFETCH_MODES, default='metadata', help='\'metadata\' fetches listings and attributes, \'data\' also content of files.')
+        parser.add_argument('--max-bytes', type=size, default=None, help='Max total size of file data fetched, like 10G. Files which would exceed it are skipped. Unlimited by default.')
+        parser.add_argument('--concurrency', type=int, default=16, help='Max number of objects fetched at once.')
+        parser.add_argument('--progress-interval', type=float, default=1.0, help='Seconds between progress reports.')
+
+    def add_positional_arguments(self):
+        self.parser.add_argument('root', type=str, help='Hash of IPFS dir to be prefetched.')
+
+    def run(self):
+        args = self.parse_args()
+
+        with self.get_ipfs_client(args) as client:
+            ipfs = CachedIPFS(client, **self.get_ipfs_kwargs(args))
+            if args.metrics_address:
+                start_metrics_server(args.metrics_address, ipfs.metrics)
+            root_cid = ipfs.resolve(args.root)
+            if root_cid is None:
+                sys.exit(f'{args.root} not found')
+
+            prefetcher = Prefetcher(
+                ipfs,
+                mode=args.mode,
+                concurrency=args.concurrency,
+                max_bytes=args.max_bytes,
+                progress=lambda progress: print(progress, file=sys.stderr),
+                progress_interval=args.progress_interval,
+            )
+            progress = prefetcher.run(root_cid)
+            ipfs.save_snapshot()
+            print(f'done: {progress}', file=sys.stderr)
+            if progress.errors:
+                sys.exit(1)
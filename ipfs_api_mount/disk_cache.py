@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """ Persistent store of IPFS nodes, keyed by CID and limited by total size of files.
+
+    Every node is a single file holding a header, JSON-encoded metadata and
+    the payload. Files are written to a temporary name and renamed into
+    place, so a crash never leaves a truncated node behind. Files are read
+    whole - nodes are small, and a memory mapping per cached payload would
+    hold a file descriptor for as long as the payload is cached.
+
+    The directory is marked with a cache directory tag, which also tells
+    backup tools to skip it. A non-empty directory without the tag is not
+    used, and only files in the layout written here are ever removed. """
+
+    HEADER = struct.Struct('<4sI')  # magic, metadata length
+    MAGIC = b'IAM1'
+    TAG_NAME = 'CACHEDIR.TAG'
+    TAG = (
+        b'Signature: 8a477f597d28d172789f06886806bc55\n'
+        b'# This file is a cache directory tag created by ipfs-api-mount.\n'
+    )
+    NODE_NAME = re.compile(r'[0-9A-Za-z]+')
+    TMP_NAME = re.compile(r'([0-9A-Za-z]+)\.[0-9]+\.tmp')
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file_sizes = OrderedDict()  # CID -> file size, least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._check_tag()
+        self._scan()
+
+    def get(self, cid):
+        """ Get `(metadata, payload)` of a node, or `None` if it's not stored. """
+        with self.lock:
+            if cid not in self.file_sizes:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.file_sizes.move_to_end(cid)
+
+        try:
+            with open(self._file_path(cid), 'rb') as f:
+                os.utime(f.fileno())  # keep LRU order across restarts
+                content = f.read()
+        except FileNotFoundError:
+            logger.warning('cached node %s disappeared', cid)
+            self._remove([cid])
+            return None
+        except OSError:
+            # like running out of file descriptors - the file itself may be fine
+            logger.warning('failed to read cached node %s', cid, exc_info=True)
+            return None
+
+        try:
+            magic, metadata_length = self.HEADER.unpack_from(content)
+            if magic != self.MAGIC:
+                raise ValueError('bad magic')
+            payload_offset = self.HEADER.size + metadata_length
+            metadata = json.loads(content[self.HEADER.size:payload_offset])
+        except (ValueError, struct.error):
+            logger.warning('dropping unreadable cached node %s', cid, exc_info=True)
+            self._remove([cid])
+            return None
+
+        return metadata, memoryview(content)[payload_offset:]
+
+    def __len__(self):
+        return len(self.file_sizes)
+
+    def put(self, cid, metadata, payload):
+        """ Store a node. Best effort - if it can't be written (like when the
+        disk is full), it's only logged. """
+        metadata = json.dumps(metadata, separators=(',', ':')).encode()
+        path = self._file_path(cid)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, len(metadata)))
+                f.write(metadata)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+                file_size = f.tell()
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning('failed to store node %s', cid, exc_info=True)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self.lock:
+            self.bytes += file_size - self.file_sizes.pop(cid, 0)
+            self.file_sizes[cid] = file_size
+            evicted = self._pop_excess()
+        self._unlink(evicted)
+
+    def _remove(self, cids):
+        with self.lock:
+            for cid in cids:
+                self.bytes -= self.file_sizes.pop(cid, 0)
+        self._unlink(cids)
+
+    def _unlink(self, cids):
+        for cid in cids:
+            try:
+                os.unlink(self._file_path(cid))
+            except FileNotFoundError:
+                pass
+
+    def _check_tag(self):
+        tag_path = os.path.join(self.path, self.TAG_NAME)
+        try:
+            with open(tag_path, 'rb') as f:
+                if f.read() == self.TAG:
+                    return
+        except FileNotFoundError:
+            if not os.listdir(self.path):
+                with open(tag_path, 'wb') as f:
+                    f.write(self.TAG)
+                return
+        raise ValueError(f'{self.path} is not empty and not a disk cache of ipfs-api-mount, refusing to use it')
+
+    def _scan(self):
+        files = []
+        for dir_name in os.listdir(self.path):
+            dir_path = os.path.join(self.path, dir_name)
+            if len(dir_name) != 2 or not os.path.isdir(dir_path):
+                continue
+            for file_name in os.listdir(dir_path):
+                file_path = os.path.join(dir_path, file_name)
+                tmp_match = self.TMP_NAME.fullmatch(file_name)
+                if tmp_match and tmp_match.group(1)[-2:] == dir_name:
+                    # leftover of interrupted write
+                    os.unlink(file_path)
+                elif self.NODE_NAME.fullmatch(file_name) and file_name[-2:] == dir_name:
+                    s = os.stat(file_path)
+                    files.append((s.st_mtime, file_name, s.st_size))
+
+        with self.lock:
+            for _, cid, file_size in sorted(files):
+                self.file_sizes[cid] = file_size
+                self.bytes += file_size
+            evicted = self._pop_excess()
+        self._unlink(evicted)
+
+    def _pop_excess(self):
+        """ Forget least recently used nodes until we fit in size limit.
+        Must be called with `self.lock` held. Returns CIDs of forgotten nodes. """
+        evicted = []
+        while self.bytes > self.max_bytes:
+            evicted_cid, evicted_size = self.file_sizes.popitem(last=False)
+            self.bytes -= evicted_size
+            evicted.append(evicted_cid)
+        return evicted
+
+    def _file_path(self, cid):
+        # CIDs share prefixes (Qm, bafy), so fan out directories on the suffix
+        return os.path.join(self.path, cid[-2:], cid)
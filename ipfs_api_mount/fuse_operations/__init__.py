@@ -1,9 +1,10 @@
 import pyfuse3
 
 from .high import IPFSOperations
+from .high_multi import MultiRootIPFSOperations
 from .high_whole import WholeIPFSOperations
 
-__all__ = ['IPFSOperations', 'default_fuse_options', 'WholeIPFSOperations']
+__all__ = ['IPFSOperations', 'default_fuse_options', 'MultiRootIPFSOperations', 'WholeIPFSOperations']
 
 default_fuse_options = set(pyfuse3.default_options)
 default_fuse_options.add('ro')
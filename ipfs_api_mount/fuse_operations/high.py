@@ -1,130 +1,341 @@
 import errno
+import itertools
 import logging
 import stat
-from dataclasses import dataclass
+from array import array
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
 
 import ipfshttpclient
 import pyfuse3
+import trio
 
+from ipfs_api_mount.cid import cid_to_str, parse_cid
 from ipfs_api_mount.ipfs import CachedIPFS, InvalidIPFSPathException
+from ipfs_api_mount.metrics import Metrics, fuse_op
 
 logger = logging.getLogger(__name__)
 
+STATS_INODE = pyfuse3.ROOT_INODE + 1
+
+# content is immutable, so the kernel can cache it for as long as it likes
+FOREVER = 365 * 24 * 60 * 60.0  # seconds
+
+READDIR_PAGE_SIZE = 64  # entries are read from the listing, and their attributes fetched, in pages of this size
+CID_STR_CACHE_SIZE = 1024  # CID strings of this many recently used inodes are kept, encoding them isn't cheap
+
+
+class InodeTable:
+    """ Inodes known to the kernel: their CIDs and lookup counts. There may
+    be millions of them, so instead of an object per inode it keeps binary
+    CIDs in a list and lookup counts in an array, both indexed by inode
+    number. Numbers of forgotten inodes are reused. """
+
+    def __init__(self, first_free):
+        self.cids = [None] * first_free  # inode number -> binary CID, None if not in use
+        self.lookup_counts = array('Q', bytes(8 * first_free))
+        self.by_cid = {}  # binary CID -> inode number
+        self.free = []  # forgotten inode numbers
+        self.cid_strs = OrderedDict()  # inode number -> CID string, least recently used first
+
+    def __len__(self):
+        return len(self.by_cid)
+
+    def cid(self, ino):
+        cid = self.cid_strs.get(ino)
+        if cid is None:
+            cid = self.cid_strs[ino] = cid_to_str(self.cids[ino])
+            if len(self.cid_strs) > CID_STR_CACHE_SIZE:
+                self.cid_strs.popitem(last=False)
+        else:
+            self.cid_strs.move_to_end(ino)
+        return cid
+
+    def lookup(self, cid):
+        """ Get inode number of given CID, allocating it if needed, and count the lookup. """
+        cid_bytes = parse_cid(cid).bytes
+        ino = self.by_cid.get(cid_bytes)
+        if ino is None:
+            if self.free:
+                ino = self.free.pop()
+            else:
+                ino = len(self.cids)
+                self.cids.append(None)
+                self.lookup_counts.append(0)
+            self.cids[ino] = cid_bytes
+            self.by_cid[cid_bytes] = ino
+        self.lookup_counts[ino] += 1
+        return ino
+
+    def set(self, ino, cid):
+        """ Bind reserved inode number (like root) to given CID, looked up once. """
+        cid_bytes = parse_cid(cid).bytes
+        self.cids[ino] = cid_bytes
+        self.by_cid[cid_bytes] = ino
+        self.lookup_counts[ino] = 1
+        self.cid_strs.pop(ino, None)
+
+    def forget(self, ino, n):
+        assert self.lookup_counts[ino] >= n
+        self.lookup_counts[ino] -= n
+        if self.lookup_counts[ino] == 0:
+            del self.by_cid[self.cids[ino]]
+            self.cids[ino] = None
+            self.cid_strs.pop(ino, None)
+            self.free.append(ino)
+
 
 @dataclass
-class IPFSInode:
+class IPFSFileHandle:
     cid: str
-    ino: int
-    lookup_count: int = 0
+    read_end: int = 0  # where the previous read ended
+    readahead_window: int = 0
+    readahead_end: int = 0  # end of range already scheduled for read-ahead
+    cursor: list = field(default_factory=list)  # see `CachedIPFS.read_into()`
+
+
+@dataclass
+class IPFSDirHandle:
+    cid: str
+    entries: object = None  # iterator over `DirEntry`, see `CachedIPFS.ls_stream()`
+    pending: deque = field(default_factory=deque)  # entries read from `entries` but not yet passed to the kernel
+    next_id: int = 0  # offset of `pending[0]`
+
+
+@dataclass
+class StatsFileHandle:
+    data: bytes  # stats rendered when the file was opened
 
 
 class BaseIPFSOperations(pyfuse3.Operations):
     def __init__(
         self,
         ipfs_client,  # ipfshttpclient client instance
+        threads=16,  # max number of concurrent daemon requests
+        read_ahead=1024 * 1024,  # max bytes fetched in advance for sequential reads, 0 disables
+        stats_file='.ipfs-api-mount-stats',  # name of hidden file in mount root showing statistics, None disables
+        entry_timeout=FOREVER,  # seconds the kernel may cache name lookups
+        attr_timeout=FOREVER,  # seconds the kernel may cache attributes
+        negative_timeout=FOREVER,  # seconds the kernel may cache failed lookups, 0 disables
         **kwargs,
     ):
-        self.ipfs = CachedIPFS(ipfs_client, **kwargs)
-        self.inodes = {}
-        self.inodes_by_cid = {}
-        self.inode_free = pyfuse3.ROOT_INODE + 1
+        self.metrics = Metrics()
+        self.entry_timeout = entry_timeout
+        self.attr_timeout = attr_timeout
+        self.negative_timeout = negative_timeout
+        self.ipfs = CachedIPFS(ipfs_client, metrics=self.metrics, **kwargs)
+        self.ipfs_limiter = trio.CapacityLimiter(threads)
+        self.read_ahead = read_ahead
+        self.stats_file = stats_file and stats_file.encode()
+        self.inodes = InodeTable(first_free=STATS_INODE + 1)
+        self.file_handles = {}
+        self.dir_handles = {}
+        self.file_handle_free = 1
+
+    async def run_ipfs(self, fn, *args):
+        """ Run blocking `CachedIPFS` method in a worker thread.
+        This way a slow daemon request doesn't stall other FUSE requests. """
+        return await trio.to_thread.run_sync(fn, *args, limiter=self.ipfs_limiter)
 
+    @fuse_op
     async def lookup(self, inode, name, ctx):
-        ipfs_inode = self.inodes[inode]
-        child_cid = self.ipfs.resolve(ipfs_inode.cid + '/' + name.decode())
+        if inode == pyfuse3.ROOT_INODE and name == self.stats_file:
+            return self._stats_attrs()
+        cid = self.inodes.cid(inode)
+        try:
+            child_cid = await self.run_ipfs(self.ipfs.child_cid, cid, name.decode())
+        except ipfshttpclient.exceptions.TimeoutError as e:
+            logger.warning('timeout while lookup(%s, %s)', cid, name)
+            raise pyfuse3.FUSEError(errno.EAGAIN) from e
+        except ipfshttpclient.exceptions.ErrorResponse as e:
+            # not a miss - the kernel would remember it for long
+            logger.warning('failed to look up %s in %s: %s', name, cid, e)
+            raise pyfuse3.FUSEError(errno.EIO) from e
         return await self.lookup_cid_or_none(child_cid, ctx)
 
     def lookup_cid(self, cid, ctx=None):
-        if cid in self.inodes_by_cid:
-            ipfs_inode = self.inodes_by_cid[cid]
-        else:
-            ipfs_inode = IPFSInode(
-                ino=self.inode_free,
-                cid=cid,
-            )
-            self.inode_free += 1
-            self.inodes[ipfs_inode.ino] = ipfs_inode
-            self.inodes_by_cid[ipfs_inode.cid] = ipfs_inode
-        ipfs_inode.lookup_count += 1
-        return self.getattr(ipfs_inode.ino, ctx)
+        return self.getattr(self.inodes.lookup(cid), ctx)
 
     async def lookup_cid_or_none(self, cid, ctx=None):
         if cid:
             return await self.lookup_cid(cid, ctx)
         else:
-            return pyfuse3.EntryAttributes(st_ino=0)
+            # inode 0 with non-zero timeout tells the kernel to cache the miss
+            attrs = pyfuse3.EntryAttributes()
+            attrs.st_ino = 0
+            attrs.entry_timeout = self.negative_timeout
+            return attrs
 
+    @fuse_op
     async def forget(self, inode_list):
         for inode, n in inode_list:
-            ipfs_inode = self.inodes[inode]
-            ipfs_inode.lookup_count -= n
-            assert ipfs_inode.lookup_count >= 0
-            if ipfs_inode.lookup_count == 0:
-                del self.inodes[ipfs_inode.ino]
-                del self.inodes_by_cid[ipfs_inode.cid]
-                del ipfs_inode
+            if inode == STATS_INODE:
+                continue
+            self.inodes.forget(inode, n)
 
+    @fuse_op
     async def open(self, inode, flags, ctx):
-        return pyfuse3.FileInfo(fh=inode, keep_cache=True)
+        fh = self.file_handle_free
+        self.file_handle_free += 1
+        if inode == STATS_INODE:
+            # snapshot is taken at open, so the file is consistent while read
+            self.file_handles[fh] = StatsFileHandle(data=self.metrics.render_text().encode())
+            return pyfuse3.FileInfo(fh=fh, direct_io=True)
+        self.file_handles[fh] = IPFSFileHandle(cid=self.inodes.cid(inode))
+        return pyfuse3.FileInfo(fh=fh, keep_cache=True)
 
+    @fuse_op
+    async def release(self, fh):
+        del self.file_handles[fh]
+
+    @fuse_op
     async def read(self, fh, offset, size):
-        inode = fh
-        cid = self.inodes[inode].cid
+        file_handle = self.file_handles[fh]
+        if isinstance(file_handle, StatsFileHandle):
+            return file_handle.data[offset:(offset + size)]
+        cid = file_handle.cid
 
         try:
-            data = bytearray(size)
-            n = self.ipfs.read_into(
+            data = await self.run_ipfs(
+                self.ipfs.read,
                 cid,
-                offset, memoryview(data),
+                offset, size,
+                file_handle.cursor,
             )
-            return bytes(data[:(n - offset)])
-
         except ipfshttpclient.exceptions.TimeoutError as e:
             logger.warning('timeout while read(%s)', cid)
             raise pyfuse3.FUSEError(errno.EAGAIN) from e
 
+        self.schedule_readahead(file_handle, offset, size, offset + len(data))
+        return data
+
+    def schedule_readahead(self, file_handle, offset, size, end):
+        """ Detect sequential reads and start fetching following blocks in background.
+        Read-ahead window doubles with every sequential read, up to `read_ahead` bytes. """
+        if offset == file_handle.read_end:
+            file_handle.readahead_window = min(
+                max(2 * file_handle.readahead_window, 2 * size),
+                self.read_ahead,
+            )
+        else:
+            file_handle.readahead_window = 0
+            file_handle.readahead_end = 0
+        file_handle.read_end = end
+
+        if end < offset + size or file_handle.readahead_window == 0:
+            # end of file, read-ahead disabled or not a sequential read
+            return
+
+        readahead_start = max(end, file_handle.readahead_end)
+        readahead_end = end + file_handle.readahead_window
+        if readahead_end <= readahead_start or readahead_end - readahead_start < file_handle.readahead_window // 2:
+            # most of the window is already scheduled
+            return
+        file_handle.readahead_end = readahead_end
+        trio.lowlevel.spawn_system_task(
+            self._readahead,
+            file_handle.cid, readahead_start, readahead_end - readahead_start,
+        )
+
+    async def _readahead(self, cid, offset, size):
+        try:
+            leaf_cids = await self.run_ipfs(self.ipfs.leaf_cids, cid, offset, size)
+        except Exception:
+            logger.debug('read-ahead of %s failed', cid, exc_info=True)
+            return
+        async with trio.open_nursery() as nursery:
+            for leaf_cid in leaf_cids:
+                nursery.start_soon(self._readahead_block, leaf_cid)
+
+    async def _readahead_block(self, cid):
+        try:
+            await self.run_ipfs(self.ipfs.block, cid)
+        except Exception:
+            logger.debug('read-ahead of %s failed', cid, exc_info=True)
+
+    @fuse_op
     async def opendir(self, inode, ctx):
-        return inode
+        fh = self.file_handle_free
+        self.file_handle_free += 1
+        self.dir_handles[fh] = IPFSDirHandle(cid=self.inodes.cid(inode))
+        return fh
 
+    @fuse_op
+    async def releasedir(self, fh):
+        await self._close_dir_entries(self.dir_handles.pop(fh))
+
+    @fuse_op
     async def readdir(self, fh, start_id, token):
-        inode = fh
-        cid = self.inodes[inode].cid
+        """ Entries are read from the listing page by page, as the kernel asks
+        for them. `start_id` is an offset in the listing, so the handle
+        remembers where the previous call stopped. """
+        dir_handle = self.dir_handles[fh]
+        if dir_handle.entries is None or start_id < dir_handle.next_id:
+            # first call, rewind or retry after error
+            await self._close_dir_entries(dir_handle)
+            dir_handle.entries = self.ipfs.ls_stream(dir_handle.cid)
+
         try:
-            ls_result = self.ipfs.cid_ls(cid)
+            while True:
+                if not dir_handle.pending:
+                    page = await self.run_ipfs(_take, dir_handle.entries, READDIR_PAGE_SIZE)
+                    if not page:
+                        return
+                    dir_handle.pending.extend(page)
+                    await self._prefetch_attrs([entry.cid for entry in page])
+
+                entry = dir_handle.pending[0]
+                if dir_handle.next_id >= start_id:
+                    entry_attrs = await self.lookup_cid(entry.cid)
+                    r = pyfuse3.readdir_reply(
+                        token,
+                        entry.name.encode(), entry_attrs,
+                        dir_handle.next_id + 1,
+                    )
+                    if not r:
+                        await self.forget([(entry_attrs.st_ino, 1)])
+                        return
+                dir_handle.pending.popleft()
+                dir_handle.next_id += 1
+
         except ipfshttpclient.exceptions.TimeoutError as e:
-            logger.warning('timeout while readdir(%s)', cid)
+            logger.warning('timeout while readdir(%s)', dir_handle.cid)
+            await self._close_dir_entries(dir_handle)
             raise pyfuse3.FUSEError(errno.EAGAIN) from e
+        except ipfshttpclient.exceptions.ErrorResponse as e:
+            logger.warning('failed to list %s: %s', dir_handle.cid, e)
+            await self._close_dir_entries(dir_handle)
+            raise pyfuse3.FUSEError(errno.EIO) from e
 
-        ls_result = ls_result[start_id:]
+    async def _close_dir_entries(self, dir_handle):
+        if dir_handle.entries is not None:
+            await self.run_ipfs(dir_handle.entries.close)
+        dir_handle.entries = None
+        dir_handle.pending.clear()
+        dir_handle.next_id = 0
 
-        for i, entry in enumerate(ls_result):
-            entry_name = entry['Name'].encode()
-            entry_cid = entry['Hash']
-            entry_attrs = await self.lookup_cid(entry_cid)
-            r = pyfuse3.readdir_reply(
-                token,
-                entry_name, entry_attrs,
-                start_id + i + 1,
-            )
-            if not r:
-                await self.forget([(entry_attrs.st_ino, 1)])
-                return
+    async def _prefetch_attrs(self, cids):
+        """ Fetch missing attributes of many objects concurrently. """
+        async def prefetch(cid):
+            try:
+                await self.run_ipfs(self._cid_mode_and_size, cid)
+            except Exception:
+                # getattr will fail with proper error
+                logger.debug('fetching attributes of %s failed', cid, exc_info=True)
 
+        # `has_attrs` may query the snapshot, keep it off the event loop
+        missing = await self.run_ipfs(lambda: [cid for cid in cids if not self.ipfs.has_attrs(cid)])
+        async with trio.open_nursery() as nursery:
+            for cid in missing:
+                nursery.start_soon(prefetch, cid)
+
+    @fuse_op
     async def getattr(self, inode, ctx):
-        cid = self.inodes[inode].cid
+        if inode == STATS_INODE:
+            return self._stats_attrs()
+        cid = self.inodes.cid(inode)
         try:
-            if self.ipfs.cid_is_dir(cid):
-                st_mode = (
-                    stat.S_IFDIR |
-                    stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
-                )
-            elif self.ipfs.cid_is_file(cid):
-                st_mode = stat.S_IFREG
-            else:
-                raise pyfuse3.FUSEError(errno.ENOENT)
-
-            st_size = self.ipfs.cid_size(cid)
-
+            st_mode, st_size = await self.run_ipfs(self._cid_mode_and_size, cid)
         except ipfshttpclient.exceptions.TimeoutError as e:
             logger.warning('timeout while getattr(%s)', cid)
             raise pyfuse3.FUSEError(errno.EAGAIN) from e
@@ -133,6 +344,8 @@ class BaseIPFSOperations(pyfuse3.Operations):
 
         attrs = pyfuse3.EntryAttributes()
         attrs.st_ino = inode
+        attrs.entry_timeout = self.entry_timeout
+        attrs.attr_timeout = self.attr_timeout
         attrs.st_atime_ns = 0
         attrs.st_ctime_ns = 0
         attrs.st_mtime_ns = 0
@@ -143,6 +356,32 @@ class BaseIPFSOperations(pyfuse3.Operations):
         attrs.st_size = st_size
         return attrs
 
+    def _stats_attrs(self):
+        attrs = pyfuse3.EntryAttributes()
+        attrs.st_ino = STATS_INODE
+        attrs.st_mode = stat.S_IFREG | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+        attrs.st_size = 0  # unknown in advance, the file is read with direct I/O
+        attrs.attr_timeout = 0
+        attrs.entry_timeout = 0
+        return attrs
+
+    def _cid_mode_and_size(self, cid):
+        if self.ipfs.cid_is_dir(cid):
+            st_mode = (
+                stat.S_IFDIR |
+                stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+            )
+        elif self.ipfs.cid_is_file(cid):
+            st_mode = stat.S_IFREG
+        else:
+            raise pyfuse3.FUSEError(errno.ENOENT)
+
+        return st_mode, self.ipfs.cid_size(cid)
+
+
+def _take(iterator, n):
+    return list(itertools.islice(iterator, n))
+
 
 class IPFSOperations(BaseIPFSOperations):
     def __init__(
@@ -156,9 +395,6 @@ class IPFSOperations(BaseIPFSOperations):
         root_cid = self.ipfs.resolve(root)
         if not self.ipfs.cid_is_dir(root_cid):
             raise InvalidIPFSPathException("root path is not a directory")
-        self.inodes[pyfuse3.ROOT_INODE] = IPFSInode(
-            cid=root_cid,
-            ino=pyfuse3.ROOT_INODE,
-            lookup_count=1,
-        )
+        self.root_cid = root_cid
+        self.inodes.set(pyfuse3.ROOT_INODE, root_cid)
         self.fsname = f'/ipfs/{root_cid}'
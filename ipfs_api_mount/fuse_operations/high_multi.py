@@ -0,0 +1,111 @@
+import stat
+from dataclasses import dataclass
+
+import pyfuse3
+
+from ipfs_api_mount.ipfs import InvalidIPFSPathException
+from ipfs_api_mount.metrics import fuse_op
+
+from .high import BaseIPFSOperations
+
+
+@dataclass
+class RootDirHandle:
+    entries: list  # [(name, cid)] of roots at the time the dir was opened
+
+
+class MultiRootIPFSOperations(BaseIPFSOperations):
+    """ Many IPFS directories under one mount, each as a subdirectory of the
+    mount root. All of them share caches, daemon connections and inodes, so
+    content common to many roots is fetched and kept once.
+
+    Roots can be replaced while mounted, see `set_roots()`. """
+
+    def __init__(
+        self,
+        roots,  # {name: IPFS path}
+        *args,
+        root_entry_timeout=60.0,  # seconds the kernel may cache names in mount root - roots may be replaced
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.root_entry_timeout = root_entry_timeout
+        self.roots = {}  # name -> CID, replaced as a whole
+        self.set_roots(roots)
+
+    @property
+    def fsname(self):
+        return '/ipfs'
+
+    def set_roots(self, roots):
+        """ Resolve given `{name: IPFS path}` and serve it instead of current roots.
+        Blocking - call it from a thread other than the event loop. """
+        resolved = {}
+        for name, path in roots.items():
+            if not name or '/' in name or name.encode() == self.stats_file:
+                raise ValueError(f'invalid root name {name!r}')
+            cid = self.ipfs.resolve(path)
+            if cid is None or not self.ipfs.cid_is_dir(cid):
+                raise InvalidIPFSPathException(f'root path {path} is not a directory')
+            resolved[name] = cid
+        self.roots = resolved
+
+    @fuse_op
+    async def lookup(self, inode, name, ctx):
+        if inode == pyfuse3.ROOT_INODE and name != self.stats_file:
+            cid = self.roots.get(name.decode())
+            attrs = await self.lookup_cid_or_none(cid, ctx)
+            attrs.entry_timeout = self.root_entry_timeout
+            return attrs
+        else:
+            return await super().lookup(inode, name, ctx)
+
+    @fuse_op
+    async def getattr(self, inode, ctx):
+        if inode == pyfuse3.ROOT_INODE:
+            attrs = pyfuse3.EntryAttributes()
+            attrs.st_ino = inode
+            attrs.attr_timeout = self.attr_timeout
+            attrs.st_atime_ns = 0
+            attrs.st_ctime_ns = 0
+            attrs.st_mtime_ns = 0
+            attrs.st_gid = 0
+            attrs.st_uid = 0
+            attrs.st_mode = (
+                stat.S_IFDIR |
+                stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH |
+                stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+            )
+            attrs.st_nlink = 0
+            attrs.st_size = 0
+            return attrs
+        else:
+            return await super().getattr(inode, ctx)
+
+    @fuse_op
+    async def opendir(self, inode, ctx):
+        if inode != pyfuse3.ROOT_INODE:
+            return await super().opendir(inode, ctx)
+        fh = self.file_handle_free
+        self.file_handle_free += 1
+        self.dir_handles[fh] = RootDirHandle(entries=sorted(self.roots.items()))
+        return fh
+
+    @fuse_op
+    async def releasedir(self, fh):
+        if isinstance(self.dir_handles[fh], RootDirHandle):
+            del self.dir_handles[fh]
+        else:
+            await super().releasedir(fh)
+
+    @fuse_op
+    async def readdir(self, fh, start_id, token):
+        dir_handle = self.dir_handles[fh]
+        if not isinstance(dir_handle, RootDirHandle):
+            return await super().readdir(fh, start_id, token)
+
+        for i, (name, cid) in enumerate(dir_handle.entries[start_id:], start=start_id):
+            entry_attrs = await self.lookup_cid(cid)
+            if not pyfuse3.readdir_reply(token, name.encode(), entry_attrs, i + 1):
+                await self.forget([(entry_attrs.st_ino, 1)])
+                return
@@ -1,26 +1,67 @@
+import errno
+import logging
 import stat
 
+import ipfshttpclient
 import pyfuse3
 
+from ipfs_api_mount.metrics import fuse_op
+from ipfs_api_mount.snapshot import is_immutable_path
+
 from .high import BaseIPFSOperations
 
+logger = logging.getLogger(__name__)
+
 
 class WholeIPFSOperations(BaseIPFSOperations):
+    def __init__(
+        self,
+        *args,
+        root_entry_timeout=60.0,  # seconds the kernel may cache IPNS and DNSLink names in mount root - they are mutable
+        root_negative_timeout=10.0,  # seconds the kernel may cache missing names in mount root
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.root_entry_timeout = root_entry_timeout
+        self.root_negative_timeout = root_negative_timeout
+
     @property
     def fsname(self):
         return '/ipfs'
 
+    @fuse_op
     async def lookup(self, inode, name, ctx):
-        if inode == pyfuse3.ROOT_INODE:
-            cid = self.ipfs.resolve(name.decode())
-            return await self.lookup_cid_or_none(cid, ctx)
+        if inode == pyfuse3.ROOT_INODE and name != self.stats_file:
+            path = name.decode()
+            immutable = is_immutable_path(path)
+            if not immutable:
+                # IPNS key or DNSLink domain
+                path = '/ipns/' + path
+            try:
+                cid = await self.run_ipfs(self.ipfs.resolve, path)
+            except ipfshttpclient.exceptions.TimeoutError as e:
+                logger.warning('timeout while resolving %s', path)
+                raise pyfuse3.FUSEError(errno.EAGAIN) from e
+            except ipfshttpclient.exceptions.ErrorResponse as e:
+                logger.warning('failed to resolve %s: %s', path, e)
+                raise pyfuse3.FUSEError(errno.EIO) from e
+            attrs = await self.lookup_cid_or_none(cid, ctx)
+            if not cid:
+                attrs.entry_timeout = self.root_negative_timeout
+            elif immutable:
+                attrs.entry_timeout = self.entry_timeout
+            else:
+                attrs.entry_timeout = self.root_entry_timeout
+            return attrs
         else:
             return await super().lookup(inode, name, ctx)
 
+    @fuse_op
     async def getattr(self, inode, ctx):
         if inode == pyfuse3.ROOT_INODE:
             attrs = pyfuse3.EntryAttributes()
             attrs.st_ino = inode
+            attrs.attr_timeout = self.attr_timeout
             attrs.st_atime_ns = 0
             attrs.st_ctime_ns = 0
             attrs.st_mtime_ns = 0
@@ -1,12 +1,23 @@
+import bisect
+import itertools
 import logging
 import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 import ipfshttpclient
-import multibase
+import mmh3
 from lru import LRU
 
-from . import unixfs_pb2
+from . import merkledag_pb2, unixfs_pb2
+from .cid import DAG_PB, RAW, cid_to_str, parse_cid
+from .disk_cache import DiskCache
+from .metrics import Metrics
+from .request_policy import RequestPolicy
+from .snapshot import MetadataSnapshot, is_immutable_path
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +26,34 @@ class InvalidIPFSPathException(Exception):
     pass
 
 
+# decoded object or raw block, `link_names`, `fanout` and `hash_type` are filled only for directories
+IPFSObject = namedtuple('IPFSObject', [
+    'type', 'data', 'filesize', 'blocksizes', 'links',
+    'link_names', 'fanout', 'hash_type',
+])
+
+# entry of directory listing, `type` and `size` as reported by the daemon's `ls`
+DirEntry = namedtuple('DirEntry', ['name', 'cid', 'type', 'size'])
+
+MURMUR3_X64_64 = 0x22  # the only hash function used by HAMT shards in practice
+
+# streamed listings longer than this are not cached - such directories are sharded anyway, so lookups are cheap
+LS_CACHE_MAX_ENTRIES = 64 * 1024
+
+IPNS_REFRESH_WORKERS = 4
+
+# daemon errors meaning that a resolved path doesn't exist, as opposed to failures like timeouts
+NOT_FOUND_ERRORS = (
+    'no link named',
+    'invalid path',
+    'invalid cid',
+    'is not a directory',
+    'not found in CAR files',
+)
+
+ATTR_TYPE_BITS = 4  # unixfs type is stored in the lowest bits of a cached attribute record, size in the rest
+
+
 class CachedIPFS:
 
     def __init__(
@@ -23,40 +62,221 @@ class CachedIPFS:
         attr_cache_size=1024 * 128,
         ls_cache_size=64,
         block_cache_size=16,  # ~16MB assuming 1MB max block size
+        block_cache_bytes=None,  # if set, limits total size of cached blocks instead of their number
         link_cache_size=256,
+        shard_cache_size=1024,  # decoded nodes of sharded directories
         timeout=30.0,  # in seconds
+        request_timeouts=None,  # {endpoint: seconds}, like {'block/get': 5.0}, overriding `timeout`
+        retries=2,  # times a request failing with timeout or connection error is repeated
+        retry_backoff=0.1,  # in seconds, doubled with every retry
+        hedge_quantile=None,  # send duplicate of a request slower than this quantile of latency, like 0.95
+        disk_cache_dir=None,  # if set, blocks are also kept on disk, surviving restarts
+        disk_cache_bytes=1024 ** 3,
+        snapshot_path=None,  # if set, metadata caches are saved in this file by `save_snapshot()` and read back on misses
+        snapshot_interval=None,  # in seconds, if set `save_snapshot()` is also called periodically
+        ipns_ttl=60.0,  # seconds a resolved mutable (IPNS, DNSLink) path is fresh, later it's refreshed in background
+        ipns_max_stale=24 * 60 * 60.0,  # seconds past `ipns_ttl` a path may be served stale, later resolving it blocks
+        metrics=None,  # `Metrics` instance to record cache and request statistics in
     ):
         self.client = ipfs_client
-        self.client_request_kwargs = {
-            'timeout': timeout,
-        }
 
         self.resolve_cache = LockingLRU(attr_cache_size)
-        self.cid_type_cache = LockingLRU(attr_cache_size)
-        self.path_size_cache = LockingLRU(attr_cache_size)
+        self.ipns_cache = LockingLRU(attr_cache_size)  # mutable path -> (CID, monotonic time of resolution)
+        self.attr_cache = LockingLRU(attr_cache_size)  # binary CID -> packed type and size, see `_pack_attrs()`
         self.ls_cache = LockingLRU(ls_cache_size)
-        self.block_cache = LockingLRU(block_cache_size)
+        self.block_cache = LockingLRU(block_cache_size, max_bytes=block_cache_bytes)
         self.subblock_cids_cache = LockingLRU(link_cache_size)
         self.subblock_sizes_cache = LockingLRU(link_cache_size)
+        self.subblock_offsets_cache = LockingLRU(link_cache_size)
+        self.shard_cache = LockingLRU(shard_cache_size)
+        if disk_cache_dir is None:
+            self.disk_cache = None
+        else:
+            self.disk_cache = DiskCache(disk_cache_dir, disk_cache_bytes)
+        self.snapshot = None if snapshot_path is None else MetadataSnapshot(snapshot_path)
+        self.ipns_ttl = ipns_ttl
+        self.ipns_max_stale = ipns_max_stale
+        self.ipns_refreshing = set()  # paths being refreshed in background
+        self.ipns_lock = threading.Lock()
+        self.ipns_executor = ThreadPoolExecutor(max_workers=IPNS_REFRESH_WORKERS, thread_name_prefix='ipns-refresh')
+
+        self.metrics = Metrics() if metrics is None else metrics
+        self.request_policy = RequestPolicy(
+            self.metrics,
+            timeout=timeout,
+            timeouts=request_timeouts,
+            retries=retries,
+            retry_backoff=retry_backoff,
+            hedge_quantile=hedge_quantile,
+        )
+        self.metrics.caches.update(
+            resolve=self.resolve_cache,
+            ipns=self.ipns_cache,
+            attr=self.attr_cache,
+            ls=self.ls_cache,
+            block=self.block_cache,
+            subblock_cids=self.subblock_cids_cache,
+            subblock_sizes=self.subblock_sizes_cache,
+            subblock_offsets=self.subblock_offsets_cache,
+            shard=self.shard_cache,
+        )
+        if self.disk_cache is not None:
+            self.metrics.caches['disk'] = self.disk_cache
+        if self.snapshot is not None:
+            self.metrics.caches['snapshot'] = self.snapshot
+            if snapshot_interval is not None:
+                threading.Thread(target=self._checkpoint_loop, args=(snapshot_interval,), daemon=True).start()
+
+    def save_snapshot(self):
+        """ Save content of metadata caches in snapshot file, if there is one. """
+        if self.snapshot is None:
+            return
+        self.snapshot.save(
+            attrs=self.attr_cache.items(),
+            resolved=self.resolve_cache.items(),
+            listings=(
+                (path, listing.to_columns()) for path, listing in self.ls_cache.items()
+                if listing is not None and is_immutable_path(path)
+            ),
+        )
+        logger.info('saved metadata snapshot, %d entries', len(self.snapshot))
+
+    def _checkpoint_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.save_snapshot()
+            except Exception:
+                logger.warning('saving metadata snapshot failed', exc_info=True)
 
     def resolve(self, path):
-        """ Get CID (content id) of a path. """
+        """ Get CID (content id) of a path. Paths starting with a CID are
+        immutable and cached for good, mutable ones (IPNS, DNSLink) for
+        `ipns_ttl` seconds - see `_resolve_mutable()`. """
+        if not is_immutable_path(path):
+            return self._resolve_mutable(path)
+
         with self.resolve_cache.get_or_lock(path) as (in_cache, value):
             if in_cache:
                 return value
 
+            cid = None if self.snapshot is None else self.snapshot.resolved(path)
+            if cid is None:
+                cid = self._resolve_uncached(path)
+            self.resolve_cache[path] = cid
+            return cid
+
+    def _resolve_mutable(self, path):
+        """ Expired entry is returned as it is, while a refresh runs in
+        background. This way slow IPNS resolution blocks only the first
+        lookup of a name, or one stale for longer than `ipns_max_stale`. """
+        with self.ipns_cache.get_or_lock(path) as (in_cache, entry):
+            if in_cache:
+                cid, resolved_at = entry
+                age = time.monotonic() - resolved_at
+                if age <= self.ipns_ttl:
+                    return cid
+                if age <= self.ipns_ttl + self.ipns_max_stale:
+                    self._schedule_ipns_refresh(path)
+                    return cid
+
             try:
-                absolute_path = self.client.resolve(path, **self.client_request_kwargs)['Path']
+                cid = self._resolve_uncached(path)
             except ipfshttpclient.exceptions.ErrorResponse:
-                absolute_path = None
+                # unresolvable names are common, the miss is cached only for `ipns_ttl` anyway
+                cid = None
+            self.ipns_cache[path] = (cid, time.monotonic())
+            return cid
 
-            if absolute_path is None or not absolute_path.startswith('/ipfs/'):
-                self.resolve_cache[path] = None
+    def _schedule_ipns_refresh(self, path):
+        with self.ipns_lock:
+            if path in self.ipns_refreshing:
+                return
+            self.ipns_refreshing.add(path)
+        self.ipns_executor.submit(self._refresh_ipns, path)
+
+    def _refresh_ipns(self, path):
+        try:
+            cid = self._resolve_uncached(path)
+        except Exception:
+            # keep serving the stale entry, next lookup will try again
+            logger.warning('refreshing %s failed', path, exc_info=True)
+        else:
+            self.ipns_cache[path] = (cid, time.monotonic())
+        finally:
+            with self.ipns_lock:
+                self.ipns_refreshing.discard(path)
+
+    def _resolve_uncached(self, path):
+        """ `None` only if the path surely doesn't exist, other daemon errors
+        are raised - a miss is cached, for immutable paths forever. """
+        try:
+            absolute_path = self._request('resolve', self.client.resolve, path)['Path']
+        except ipfshttpclient.exceptions.ErrorResponse as e:
+            if any(message in str(e) for message in NOT_FOUND_ERRORS):
                 return None
+            raise
 
-            cid = absolute_path[6:]  # strip '/ipfs/'
-            self.resolve_cache[path] = cid
-            return cid
+        if absolute_path is None or not absolute_path.startswith('/ipfs/'):
+            return None
+        return absolute_path[6:]  # strip '/ipfs/'
+
+    def child_cid(self, cid, name):
+        """ Get CID of directory entry. It's found in cached listing of the
+        directory if there is one. Entries of sharded directories are found
+        locally, fetching only shards on the way to the entry. """
+        listing = self._cached_listing(cid)
+        if listing is not None:
+            i = listing.find(name)
+            return None if i is None else listing[i].cid
+
+        if self.cid_type(cid) == unixfs_pb2.Data.HAMTShard:
+            shard = self._shard(cid)
+            if shard is not None:
+                return self._shard_child_cid(cid, shard, name)
+        return self.resolve(cid + '/' + name)
+
+    def _shard_child_cid(self, cid, shard, name):
+        hash_value = mmh3.hash64(name.encode(), signed=False)[0]
+        hash_bits_left = 64
+        while True:
+            fanout, links = shard
+            bits = fanout.bit_length() - 1
+            if bits > hash_bits_left:
+                # too deep, real shards never get here
+                return None
+            hash_bits_left -= bits
+            index = (hash_value >> hash_bits_left) & (fanout - 1)
+
+            # links are named by hex index, followed by entry name (no name for subshards)
+            prefix = '{:0{}X}'.format(index, len('{:X}'.format(fanout - 1)))
+            if prefix + name in links:
+                return links[prefix + name]
+            if prefix not in links:
+                return None
+            cid = links[prefix]
+            shard = self._shard(cid)
+            if shard is None:
+                return None
+
+    def _shard(self, cid):
+        """ Get `(fanout, {link name: CID})` of HAMT shard, or `None` if it's not a shard we can walk. """
+        with self.shard_cache.get_or_lock(cid) as (in_cache, value):
+            if in_cache:
+                return value
+
+            ipfs_object = self._load_object(cid)
+            if (
+                ipfs_object.type != unixfs_pb2.Data.HAMTShard or
+                ipfs_object.hash_type != MURMUR3_X64_64 or
+                ipfs_object.fanout < 2 or
+                ipfs_object.fanout & (ipfs_object.fanout - 1)  # not a power of 2
+            ):
+                shard = None
+            else:
+                shard = ipfs_object.fanout, dict(zip(ipfs_object.link_names, ipfs_object.links))
+            self.shard_cache[cid] = shard
+            return shard
 
     def block(self, cid):
         """ Get payload of IPFS object or raw block """
@@ -66,14 +286,11 @@ class CachedIPFS:
 
             if self._is_object(cid):
                 # object
-                object_data = self._load_object(cid)
-                return object_data.Data
+                return self._load_object(cid).data
 
             elif self._is_raw_block(cid):
                 # raw block
-                block = self.client.block.get(cid, **self.client_request_kwargs)
-                self.block_cache[cid] = block
-                return block
+                return self._load_raw_block(cid).data
 
             else:
                 # unknown object type
@@ -88,15 +305,7 @@ class CachedIPFS:
                 if in_cache:
                     return value
 
-                subblock_cids = [
-                    link['Hash']
-                    for link in self.client.object.links(
-                        cid,
-                        **self.client_request_kwargs,
-                    ).get('Links', [])
-                ]
-                self.subblock_cids_cache[cid] = subblock_cids
-                return subblock_cids
+                return self._load_object(cid).links
 
         elif self._is_raw_block(cid):
             # raw block - it has no subblocks
@@ -117,8 +326,7 @@ class CachedIPFS:
                 if in_cache:
                     return value
 
-                object_data = self._load_object(cid)
-                return object_data.blocksizes
+                return self._load_object(cid).blocksizes
 
         elif self._is_raw_block(cid):
             # raw block - it has no subblocks
@@ -128,72 +336,115 @@ class CachedIPFS:
             # unknown object type
             raise InvalidIPFSPathException()
 
-    def ls(self, path):
-        with self.ls_cache.get_or_lock(path) as (in_cache, value):
-            if in_cache:
-                return value
-
-            try:
-                ls_result = self.client.ls(
-                    path,
-                    **self.client_request_kwargs,
-                )['Objects'][0]['Links']
-
-            except ipfshttpclient.exceptions.ErrorResponse:
-                ls_result = None
-
-            self.ls_cache[path] = ls_result
-            return ls_result
-
-    def cid_ls(self, cid):
-        # cid is a valid path
-        return self.ls(cid)
+    def ls_stream(self, path):
+        """ Iterate over `DirEntry` of a directory. Cached listing is used if
+        there is one, otherwise entries are yielded as the daemon streams them
+        (unsorted), and the listing is cached once complete. Blocks while
+        iterating, `close()` it if it's abandoned midway. Cached listing keeps
+        the order of the stream, so offsets in it are stable. """
+        listing = self._cached_listing(path)
+        if listing is not None:
+            yield from listing
+            return
+
+        def open_stream(path, timeout):
+            # request is measured until the first response, we don't know how fast we'll be consumed
+            responses = self.client.ls(path, stream=True, opts={'stream': 'true'}, timeout=timeout)
+            return responses, next(iter(responses), None)
+
+        responses, first_response = self.request_policy.request('ls', open_stream, path, hedge=False)
+
+        collected = []
+        try:
+            if first_response is not None:
+                for response in itertools.chain([first_response], responses):
+                    for link in response['Objects'][0]['Links']:
+                        entry = _dir_entry(link)
+                        self._seed_attrs(entry)
+                        if collected is not None:
+                            collected.append(entry)
+                            if len(collected) > LS_CACHE_MAX_ENTRIES:
+                                collected = None
+                        yield entry
+        finally:
+            if hasattr(responses, 'close'):
+                responses.close()
+
+        if collected is not None:
+            self.ls_cache[path] = DirListing(collected)
+
+    def _cached_listing(self, path):
+        """ Get `DirListing` from cache or snapshot, without asking the daemon. """
+        in_cache, listing = self.ls_cache.get(path)
+        if in_cache:
+            return listing
+        listing = self._snapshot_listing(path)
+        if listing is not None:
+            self.ls_cache[path] = listing
+        return listing
+
+    def _snapshot_listing(self, path):
+        columns = None if self.snapshot is None else self.snapshot.listing(path)
+        return None if columns is None else DirListing.from_columns(columns)
+
+    def _seed_attrs(self, entry):
+        # type and size of files come for free, directories may be sharded so we have to look at them anyway
+        if entry.type == unixfs_pb2.Data.File:
+            self._set_attrs(entry.cid, unixfs_pb2.Data.File, entry.size)
 
     def cid_size(self, cid):
         if cid is None:
             return None
+        return self._attrs(cid)[1]
 
-        with self.path_size_cache.get_or_lock(cid) as (in_cache, value):
-            if in_cache:
-                return value
-
-            if self._is_object(cid):
-                # object
-                object_data = self._load_object(cid)
-                return object_data.filesize
-
-            elif self._is_raw_block(cid):
-                # raw block
-                in_cache, block = self.block_cache.get(cid)
-                if in_cache:
-                    size = len(block)
-                else:
-                    size = self.client.block.stat(
-                        cid,
-                        **self.client_request_kwargs,
-                    )['Size']
-                self.path_size_cache[cid] = size
-                return size
-
-            else:
-                # unknown object type
-                raise InvalidIPFSPathException()
+    def has_attrs(self, cid):
+        """ Check if `cid_type()` and `cid_size()` of given object can be answered without requests. """
+        if self._codec(cid) not in (DAG_PB, RAW):
+            return False
+        key = parse_cid(cid).bytes
+        return key in self.attr_cache or (self.snapshot is not None and self.snapshot.attrs(key) is not None)
 
     def cid_type(self, cid):
-        if self._is_object(cid):
-            with self.cid_type_cache.get_or_lock(cid) as (in_cache, value):
-                if in_cache:
-                    return value
-
-                object_data = self._load_object(cid)
-                return object_data.Type
-
-        elif self._is_raw_block(cid):
+        if self._is_raw_block(cid):
             return unixfs_pb2.Data.Raw
+        return self._attrs(cid)[0]
 
-        else:
+    def _attrs(self, cid):
+        """ Get type and size of an object. """
+        codec = self._codec(cid)
+        if codec not in (DAG_PB, RAW):
             raise InvalidIPFSPathException()
 
+        with self.attr_cache.get_or_lock(parse_cid(cid).bytes) as (in_cache, value):
+            if in_cache:
+                return _unpack_attrs(value)
+
+            value = None if self.snapshot is None else self.snapshot.attrs(parse_cid(cid).bytes)
+            if value is not None:
+                self.attr_cache[parse_cid(cid).bytes] = value
+                return _unpack_attrs(value)
+
+            if codec == DAG_PB:
+                ipfs_object = self._load_object(cid)
+                return ipfs_object.type, ipfs_object.filesize
+
+            # raw block, the size is all we need
+            in_cache, block = self.block_cache.get(cid)
+            if not in_cache:
+                stored = self._load_from_disk(cid)
+                in_cache, block = stored is not None, stored and stored.data
+            if in_cache:
+                size = len(block)
+            elif parse_cid(cid).is_inline:
+                size = len(parse_cid(cid).digest)
+            else:
+                size = self._request('block/stat', self.client.block.stat, cid)['Size']
+            self._set_attrs(cid, unixfs_pb2.Data.Raw, size)
+            return unixfs_pb2.Data.Raw, size
+
+    def _set_attrs(self, cid, object_type, size):
+        self.attr_cache[parse_cid(cid).bytes] = _pack_attrs(object_type, size)
+
     def cid_is_dir(self, cid):
         if cid is None:
             return False
@@ -212,101 +463,375 @@ class CachedIPFS:
             unixfs_pb2.Data.Raw,
         )
 
-    def read_into(self, cid, offset, buff):
+    def subblock_offsets(self, cid):
+        """ Get offsets (relative to given object / block) at which
+        consecutive linked blocks begin. Last element is the end of the object.
+        """
+        with self.subblock_offsets_cache.get_or_lock(cid) as (in_cache, value):
+            if in_cache:
+                return value
+
+            offsets = array('Q', [len(self.block(cid))])
+            for blocksize in self.subblock_sizes(cid):
+                offsets.append(offsets[-1] + blocksize)
+            self.subblock_offsets_cache[cid] = offsets
+            return offsets
+
+    def read(self, cid, offset, size, cursor=None):
+        """ Read up to `size` bytes begining at `offset`. Returns a bytes-like
+        object. Data contained in a single block is returned without copying,
+        data spanning multiple blocks is copied once. See `read_into()` for
+        `cursor` description. """
+        path = self._cursor_path(cid, cursor)
+        found = self._descend(path, offset)
+        if cursor is not None:
+            cursor[:] = path
+        if found is None:
+            return b''
+
+        node_cid, relative_offset, data_size = found
+        if (
+            relative_offset + size <= data_size or
+            path[-1][1] + data_size == path[0][2]  # this is the last block of the file
+        ):
+            return memoryview(self.block(node_cid))[relative_offset:(relative_offset + size)]
+
+        buff = bytearray(size)
+        end = self.read_into(cid, offset, memoryview(buff), cursor)
+        return memoryview(buff)[:(end - offset)]
+
+    def read_into(self, cid, offset, buff, cursor=None):
         """ Read bytes begining at `offset` from given object/raw into
-        buffer. Returns end offset of copied data. """
-        size = len(buff)
+        buffer. Returns end offset of copied data.
 
+        `cursor` is a list remembering the path from the root to the last
+        read block. Passing the same list to subsequent reads of a file lets
+        them skip descending from the root. """
+        size = len(buff)
         end = offset
+        path = self._cursor_path(cid, cursor)
 
-        # copy data contained in this object
-        d = self.block(cid)[offset:(offset + size)]
-        n = len(d)
-        buff[0:n] = d
-        end += n
-
-        # copied all requested data?
-        if size <= n:
-            return end
-
-        # descend into child objects
-        block_offset = len(self.block(cid))
-        for blocksize, child_hash in zip(
-            self.subblock_sizes(cid),
-            self.subblock_cids(cid),
-        ):
-            if offset + size <= block_offset:
-                # current block is past requested range
+        while end < offset + size:
+            found = self._descend(path, end)
+            if found is None:
                 break
-            elif block_offset + blocksize <= offset:
-                # current block is before requested range
-                pass
-            else:
-                end = self.read_into(
-                    child_hash,
-                    max(0, offset - block_offset),
-                    buff[(end - offset):(end - offset + blocksize)],
-                ) + block_offset
-
-            # update offset to next block
-            block_offset += blocksize
+            node_cid, relative_end, data_size = found
+            n = min(data_size - relative_end, offset + size - end)
+            buff[(end - offset):(end - offset + n)] = memoryview(self.block(node_cid))[relative_end:(relative_end + n)]
+            end += n
 
+        if cursor is not None:
+            cursor[:] = path
         return end
 
+    def _cursor_path(self, cid, cursor):
+        """ Get list of `(cid, start offset, end offset)` of nodes, from the root to the last visited one. """
+        path = list(cursor or ())
+        if not path or path[0][0] != cid:
+            path = [(cid, 0, self.subblock_offsets(cid)[-1])]
+        return path
+
+    def _descend(self, path, position):
+        """ Update `path` so it ends with the node whose own data contains
+        `position`. Returns CID of that node, `position` relative to it and
+        size of its own data. Returns `None` if `position` is past the end. """
+
+        # go up until we are in a node containing `position`
+        while len(path) > 1 and not path[-1][1] <= position < path[-1][2]:
+            path.pop()
+
+        while True:
+            node_cid, node_start, _ = path[-1]
+            offsets = self.subblock_offsets(node_cid)
+            relative_position = position - node_start
+
+            if relative_position >= offsets[-1]:
+                # end of file (or a node shorter than declared by its parent)
+                return None
+
+            elif relative_position < offsets[0]:
+                return node_cid, relative_position, offsets[0]
+
+            else:
+                # descend into child node containing `position`
+                i = bisect.bisect_right(offsets, relative_position) - 1
+                path.append((
+                    self.subblock_cids(node_cid)[i],
+                    node_start + offsets[i],
+                    node_start + offsets[i + 1],
+                ))
+
+    def leaf_cids(self, cid, offset, size):
+        """ Get CIDs of leaf blocks holding data in given range of a file. """
+        if not self.subblock_sizes(cid):
+            # don't look into leaves - they are what we are supposed to fetch
+            return [cid]
+
+        leaf_cids = []
+        offsets = self.subblock_offsets(cid)
+        subblock_cids = self.subblock_cids(cid)
+        i = max(bisect.bisect_right(offsets, offset) - 1, 0)
+        while i < len(subblock_cids) and offsets[i] < offset + size:
+            if offset < offsets[i + 1]:
+                leaf_cids.extend(self.leaf_cids(
+                    subblock_cids[i],
+                    max(0, offset - offsets[i]),
+                    offset + size - max(offset, offsets[i]),
+                ))
+            i += 1
+
+        return leaf_cids
+
     def _load_object(self, cid):
         """ Get object data and fill relevant caches """
-        object_data = unixfs_pb2.Data()
-        object_data.ParseFromString(self.client.object.data(
-            cid,
-            **self.client_request_kwargs,
-        ))
-
-        self.cid_type_cache[cid] = object_data.Type
-        self.path_size_cache[cid] = object_data.filesize
-        self.block_cache[cid] = object_data.Data
-        self.subblock_sizes_cache[cid] = object_data.blocksizes
+        ipfs_object = self._load_from_disk(cid)
+
+        if ipfs_object is None:
+            # one request for the whole dag-pb node, decoded locally
+            node = merkledag_pb2.PBNode()
+            node.ParseFromString(bytes(self._get_block(cid)))
+            object_data = unixfs_pb2.Data()
+            object_data.ParseFromString(node.Data)
+
+            is_dir = object_data.Type in (unixfs_pb2.Data.Directory, unixfs_pb2.Data.HAMTShard)
+            ipfs_object = IPFSObject(
+                type=object_data.Type,
+                data=object_data.Data,
+                filesize=object_data.filesize,
+                blocksizes=list(object_data.blocksizes),
+                links=[cid_to_str(link.Hash) for link in node.Links],
+                link_names=[link.Name for link in node.Links] if is_dir else [],
+                fanout=object_data.fanout,
+                hash_type=object_data.hashType,
+            )
+            self._store_on_disk(cid, ipfs_object)
+
+        self._set_attrs(cid, ipfs_object.type, ipfs_object.filesize)
+        self.block_cache[cid] = ipfs_object.data
+        self.subblock_sizes_cache[cid] = ipfs_object.blocksizes
+        self.subblock_cids_cache[cid] = ipfs_object.links
+
+        return ipfs_object
+
+    def _load_raw_block(self, cid):
+        """ Get raw block and fill relevant caches """
+        ipfs_object = self._load_from_disk(cid)
+
+        if ipfs_object is None:
+            block = self._get_block(cid)
+            ipfs_object = IPFSObject(
+                type=unixfs_pb2.Data.Raw,
+                data=block,
+                filesize=len(block),
+                blocksizes=[],
+                links=[],
+                link_names=[],
+                fanout=0,
+                hash_type=0,
+            )
+            self._store_on_disk(cid, ipfs_object)
+
+        self._set_attrs(cid, ipfs_object.type, ipfs_object.filesize)
+        self.block_cache[cid] = ipfs_object.data
+
+        return ipfs_object
+
+    def _request(self, endpoint, fn, arg):
+        """ Make daemon request, according to request policy. """
+        return self.request_policy.request(endpoint, fn, arg)
+
+    def _load_from_disk(self, cid):
+        if self.disk_cache is None:
+            return None
+        stored = self.disk_cache.get(cid)
+        if stored is None:
+            return None
+        metadata, data = stored
+        return IPFSObject(data=data, **metadata)
 
-        return object_data
+    def _store_on_disk(self, cid, ipfs_object):
+        if self.disk_cache is None or parse_cid(cid).is_inline:
+            return
+        metadata = ipfs_object._asdict()
+        data = metadata.pop('data')
+        self.disk_cache.put(cid, metadata, data)
 
     def _is_object(self, cid):
-        if cid.startswith('Q'):
-            # v0 object
-            return True
+        return self._codec(cid) == DAG_PB
 
+    def _is_raw_block(self, cid):
+        return self._codec(cid) == RAW
+
+    def _codec(self, cid):
         try:
-            cid_bytes = multibase.decode(cid)
+            return parse_cid(cid).codec
         except ValueError:
             logger.exception("encountered malformed object/block id")
-            return False
+            return None
 
-        # v1 object
-        return cid_bytes.startswith(bytes([0x01, 0x70]))
+    def _get_block(self, cid):
+        """ Fetch block data. Inlined blocks (identity multihash) are taken from the CID itself. """
+        parsed = parse_cid(cid)
+        if parsed.is_inline:
+            return parsed.digest
+        return self._request('block/get', self.client.block.get, cid)
+
+
+def _pack_attrs(object_type, size):
+    # a single int takes much less memory than a tuple of two
+    return size << ATTR_TYPE_BITS | object_type
+
+
+def _unpack_attrs(value):
+    return value & ((1 << ATTR_TYPE_BITS) - 1), value >> ATTR_TYPE_BITS
+
+
+def _dir_entry(ls_link):
+    return DirEntry(name=ls_link['Name'], cid=ls_link['Hash'], type=ls_link['Type'], size=ls_link['Size'])
+
+
+class DirListing:
+    """ Directory entries in the order they were listed in, packed into a
+    few flat buffers. Entries are `DirEntry` tuples, created on access. A list
+    of `ls` result dicts would take around a kilobyte per entry, this takes
+    ~100 bytes. Index of entries sorted by name is built on first `find()`. """
+
+    def __init__(self, entries):
+        names = bytearray()
+        cids = bytearray()
+        self.name_ends = array('I')
+        self.cid_ends = array('I')
+        self.types = array('b')
+        self.sizes = array('Q')
+        self.by_name = None
+        for entry in entries:
+            names += entry.name.encode()
+            self.name_ends.append(len(names))
+            cids += entry.cid.encode()
+            self.cid_ends.append(len(cids))
+            self.types.append(entry.type)
+            self.sizes.append(entry.size)
+        self.names = bytes(names)
+        self.cids = bytes(cids)
+
+    COLUMNS = ('names', 'cids', 'name_ends', 'cid_ends', 'types', 'sizes')
+
+    def to_columns(self):
+        """ Buffers the listing is made of, for storing it. """
+        return [bytes(getattr(self, column)) for column in self.COLUMNS]
+
+    @classmethod
+    def from_columns(cls, columns):
+        listing = cls.__new__(cls)
+        listing.names, listing.cids = bytes(columns[0]), bytes(columns[1])
+        for column, typecode, data in zip(cls.COLUMNS[2:], 'IIbQ', columns[2:]):
+            values = array(typecode)
+            values.frombytes(data)
+            setattr(listing, column, values)
+        listing.by_name = None
+        return listing
+
+    def __len__(self):
+        return len(self.name_ends)
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        cid_start = self.cid_ends[i - 1] if i else 0
+        return DirEntry(
+            name=self._name(i).decode(),
+            cid=self.cids[cid_start:self.cid_ends[i]].decode(),
+            type=self.types[i],
+            size=self.sizes[i],
+        )
 
-    def _is_raw_block(self, cid):
-        try:
-            cid_bytes = multibase.decode(cid)
-        except ValueError:
-            logger.exception("encountered malformed object/block id")
-            return False
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def find(self, name):
+        """ Get index of entry with given name, or `None` if there is no such entry. """
+        if self.by_name is None:
+            self.by_name = array('I', sorted(range(len(self)), key=self._name))
+        name = name.encode()
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(self.by_name[middle]) < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self._name(self.by_name[low]) == name:
+            return self.by_name[low]
+        return None
+
+    def _name(self, i):
+        return self.names[(self.name_ends[i - 1] if i else 0):self.name_ends[i]]
 
-        # v1 raw block
-        return cid_bytes.startswith(bytes([0x01, 0x55]))
+
+class SizedLRU:
+    """ LRU mapping limited by total length of values instead of number of entries. """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        value = self.entries[key]
+        self.entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.entries:
+            self.bytes -= len(self.entries.pop(key))
+        self.entries[key] = value
+        self.bytes += len(value)
+
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def items(self):
+        return self.entries.items()
 
 
 class LockingLRU:
-    def __init__(self, *args, **kwargs):
-        self.cache = LRU(*args, **kwargs)
+    def __init__(self, max_size=None, max_bytes=None):
+        if max_bytes is None:
+            self.cache = LRU(max_size)
+        else:
+            self.cache = SizedLRU(max_bytes)
         self.global_lock = threading.Lock()
         self.key_events = {}
+        # lookup statistics - waits are lookups which had to wait for a value being fetched by another thread
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __contains__(self, key):
+        with self.global_lock:
+            return key in self.cache
 
     def get(self, key):
         while True:
             with self.global_lock:
                 if key in self.cache:
+                    self.hits += 1
                     return True, self.cache[key]
                 if key in self.key_events:
+                    self.waits += 1
                     key_event = self.key_events[key]
                 else:
+                    self.misses += 1
                     return False, None
 
             key_event.wait()
@@ -328,14 +853,22 @@ class LockingLRU:
         with self.global_lock:
             self.cache[key] = value
 
+    def items(self):
+        """ Copy of cached `(key, value)` pairs. """
+        with self.global_lock:
+            return list(self.cache.items())
+
     def _get_value_or_release_event(self, key):
         while True:
             with self.global_lock:
                 if key in self.cache:
+                    self.hits += 1
                     return self.cache[key], None
                 if key in self.key_events:
+                    self.waits += 1
                     key_event = self.key_events[key]
                 else:
+                    self.misses += 1
                     key_event = threading.Event()
                     self.key_events[key] = key_event
                     return None, key_event
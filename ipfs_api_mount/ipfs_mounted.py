@@ -49,6 +49,7 @@ class IPFSFUSEThread(Thread):
             raise
         else:
             pyfuse3.close()
+            self.fuse_operations.ipfs.save_snapshot()
 
     def get_fuse_options(self):
         fuse_options = set(default_fuse_options)
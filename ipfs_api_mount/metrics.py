@@ -0,0 +1,268 @@
+import bisect
+import contextvars
+import functools
+import http.server
+import logging
+import os
+import socketserver
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'ipfs_api_mount'
+
+# upper bounds of histogram buckets, in seconds
+BUCKETS = (
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0,
+    10.0, 30.0, float('inf'),
+)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)  # not cumulative
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding given quantile. """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """ Counters and timings of a mount: hits and misses of caches, daemon
+    requests per endpoint and FUSE operations. Caches are registered in
+    `caches` and read when rendering, everything else is recorded here. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.caches = {}  # name -> object with `hits`, `misses`, `waits` and `len()`
+        self.requests = defaultdict(Histogram)  # endpoint -> durations
+        self.request_errors = defaultdict(int)  # endpoint -> count
+        self.requests_in_flight = 0
+        self.request_retries = defaultdict(int)  # endpoint -> count
+        self.request_hedges = defaultdict(int)  # endpoint -> duplicates sent
+        self.request_hedge_wins = defaultdict(int)  # endpoint -> duplicates answering first
+        self.fuse_ops = defaultdict(Histogram)  # operation -> durations
+        self.fuse_op_errors = defaultdict(int)  # operation -> count
+
+    @contextmanager
+    def request(self, endpoint):
+        """ Measure a daemon request. """
+        with self.lock:
+            self.requests_in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self.lock:
+                self.request_errors[endpoint] += 1
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.requests_in_flight -= 1
+                self.requests[endpoint].observe(duration)
+
+    def count_retry(self, endpoint):
+        with self.lock:
+            self.request_retries[endpoint] += 1
+
+    def count_hedge(self, endpoint):
+        with self.lock:
+            self.request_hedges[endpoint] += 1
+
+    def count_hedge_win(self, endpoint):
+        with self.lock:
+            self.request_hedge_wins[endpoint] += 1
+
+    def observe_fuse_op(self, op, duration, failed):
+        with self.lock:
+            self.fuse_ops[op].observe(duration)
+            if failed:
+                self.fuse_op_errors[op] += 1
+
+    def render_text(self):
+        """ Human readable summary, served as the stats file. """
+        lines = ['caches:']
+        for name, cache in sorted(self.caches.items()):
+            hits, misses, waits = cache.hits, cache.misses, getattr(cache, 'waits', 0)
+            ratio = hits / (hits + misses) if hits + misses else 0.0
+            lines.append(
+                f'  {name:18} hits {hits:<10} misses {misses:<10} waits {waits:<8} '
+                f'hit ratio {ratio:6.1%}  entries {len(cache)}'
+            )
+
+        with self.lock:
+            lines.append(f'daemon requests (in flight {self.requests_in_flight}):')
+            lines.extend(self._render_histograms_text(self.requests, self.request_errors))
+            for endpoint in sorted(self.request_retries.keys() | self.request_hedges.keys()):
+                lines.append(
+                    f'  {endpoint:18} retries {self.request_retries[endpoint]:<8} '
+                    f'hedges {self.request_hedges[endpoint]:<8} won by hedge {self.request_hedge_wins[endpoint]}'
+                )
+            lines.append('fuse operations:')
+            lines.extend(self._render_histograms_text(self.fuse_ops, self.fuse_op_errors))
+        return '\n'.join(lines) + '\n'
+
+    def _render_histograms_text(self, histograms, errors):
+        for name, histogram in sorted(histograms.items()):
+            mean = histogram.sum / histogram.count
+            yield (
+                f'  {name:18} count {histogram.count:<10} errors {errors[name]:<8} '
+                f'mean {_ms(mean)}  p50 <={_ms(histogram.quantile(0.5))}  '
+                f'p90 <={_ms(histogram.quantile(0.9))}  p99 <={_ms(histogram.quantile(0.99))}'
+            )
+
+    def render_prometheus(self):
+        """ Metrics in Prometheus text exposition format. """
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {metric_type}')
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                if label_text:
+                    label_text = '{' + label_text + '}'
+                lines.append(f'{PREFIX}_{name}{suffix}{label_text} {value}')
+
+        def histogram_samples(label, histograms):
+            for name, histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    yield '_bucket', [(label, name), ('le', le)], cumulative
+                yield '_sum', [(label, name)], histogram.sum
+                yield '_count', [(label, name)], histogram.count
+
+        caches = sorted(self.caches.items())
+        for event in ('hits', 'misses', 'waits'):
+            metric(
+                f'cache_{event}_total', 'counter', f'Number of cache lookups - {event}.',
+                [('', [('cache', name)], getattr(cache, event, 0)) for name, cache in caches],
+            )
+        metric(
+            'cache_entries', 'gauge', 'Number of cached entries.',
+            [('', [('cache', name)], len(cache)) for name, cache in caches],
+        )
+
+        with self.lock:
+            metric(
+                'daemon_requests_in_flight', 'gauge', 'Number of daemon requests in progress.',
+                [('', [], self.requests_in_flight)],
+            )
+            metric(
+                'daemon_request_duration_seconds', 'histogram', 'Duration of daemon requests.',
+                histogram_samples('endpoint', self.requests),
+            )
+            metric(
+                'daemon_request_errors_total', 'counter', 'Number of failed daemon requests.',
+                [('', [('endpoint', name)], n) for name, n in sorted(self.request_errors.items())],
+            )
+            for name, counts, help_text in (
+                ('retries', self.request_retries, 'Number of retried daemon requests.'),
+                ('hedges', self.request_hedges, 'Number of duplicate (hedged) daemon requests sent.'),
+                ('hedge_wins', self.request_hedge_wins, 'Number of hedged daemon requests answering before the original.'),
+            ):
+                metric(
+                    f'daemon_request_{name}_total', 'counter', help_text,
+                    [('', [('endpoint', endpoint)], n) for endpoint, n in sorted(counts.items())],
+                )
+            metric(
+                'fuse_op_duration_seconds', 'histogram', 'Duration of FUSE operations.',
+                histogram_samples('op', self.fuse_ops),
+            )
+            metric(
+                'fuse_op_errors_total', 'counter', 'Number of FUSE operations ending with error.',
+                [('', [('op', name)], n) for name, n in sorted(self.fuse_op_errors.items())],
+            )
+        return '\n'.join(lines) + '\n'
+
+
+def _ms(seconds):
+    if seconds == float('inf'):
+        return 'inf'
+    return f'{seconds * 1000:.3g}ms'
+
+
+_current_fuse_op = contextvars.ContextVar('current_fuse_op', default=None)
+
+
+def fuse_op(fn):
+    """ Decorator of FUSE operation handlers, measuring them in `self.metrics`.
+    Handlers called from within another handler (like `super().getattr()`)
+    are not measured separately. """
+    @functools.wraps(fn)
+    async def wrapper(self, *args, **kwargs):
+        if _current_fuse_op.get() is not None:
+            return await fn(self, *args, **kwargs)
+
+        token = _current_fuse_op.set(fn.__name__)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await fn(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _current_fuse_op.reset(token)
+            self.metrics.observe_fuse_op(fn.__name__, time.perf_counter() - start, failed)
+    return wrapper
+
+
+def start_metrics_server(address, metrics):
+    """ Serve metrics in Prometheus format over HTTP, in a background thread.
+    `address` is `host:port` or `unix:/path/to/socket`. Returns the server. """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = _UnixHTTPServer(path, Handler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = http.server.ThreadingHTTPServer((host or '127.0.0.1', int(port)), Handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info('serving metrics at %s', address)
+    return server
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    def get_request(self):
+        request, _ = super().get_request()
+        # `BaseHTTPRequestHandler` expects (host, port) client address
+        return request, ('unix', 0)
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+MODES = ('metadata', 'data')
+
+
+@dataclass
+class PrefetchProgress:
+    dirs: int = 0
+    files: int = 0
+    bytes: int = 0  # of file data fetched
+    skipped_files: int = 0  # not fetched because of byte budget
+    errors: int = 0
+    pending: int = 0  # objects and blocks waiting to be fetched
+    elapsed: float = 0.0  # seconds
+
+    def __str__(self):
+        throughput = self.bytes / self.elapsed if self.elapsed else 0.0
+        return (
+            f'{self.dirs} dirs, {self.files} files, {self.bytes / 1024 ** 2:.1f}MB '
+            f'({throughput / 1024 ** 2:.1f}MB/s), {self.pending} pending, '
+            f'{self.skipped_files} skipped, {self.errors} errors, {self.elapsed:.1f}s'
+        )
+
+
+class Prefetcher:
+    """ Walks a DAG with bounded concurrency, filling caches of `CachedIPFS`.
+
+    In 'metadata' mode directories are listed and attributes of all entries
+    fetched. In 'data' mode all blocks of files are fetched as well - they
+    end up in block cache and, more usefully, in disk cache if there is one.
+    Data is fetched until `max_bytes` would be exceeded, files which don't
+    fit are skipped. """
+
+    def __init__(
+        self,
+        ipfs,  # `CachedIPFS` instance
+        mode='metadata',
+        concurrency=16,  # max number of objects fetched at once
+        max_bytes=None,  # budget of file data, None for unlimited
+        progress=None,  # called with `PrefetchProgress` every `progress_interval` seconds
+        progress_interval=1.0,
+    ):
+        if mode not in MODES:
+            raise ValueError(f'unknown mode {mode!r}')
+        self.ipfs = ipfs
+        self.mode = mode
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.stats = PrefetchProgress()
+        self.reserved_bytes = 0
+
+    def run(self, cid):
+        """ Prefetch everything under given CID. Returns final `PrefetchProgress`. """
+        start = time.monotonic()
+        last_report = start
+        pending = deque([(self._visit, cid)])
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='prefetch') as executor:
+            while pending or running:
+                # don't submit everything at once, there may be millions of entries
+                while pending and len(running) < 2 * self.concurrency:
+                    running.add(executor.submit(*pending.popleft()))
+                done, running = wait(running, timeout=self.progress_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.extend(future.result())
+
+                now = time.monotonic()
+                with self.lock:
+                    self.stats.pending = len(pending) + len(running)
+                    self.stats.elapsed = now - start
+                if self.progress is not None and now - last_report >= self.progress_interval:
+                    last_report = now
+                    self.progress(self.stats)
+
+        self.stats.elapsed = time.monotonic() - start
+        return self.stats
+
+    def _visit(self, cid):
+        """ Fetch attributes of an object. Returns further work. """
+        try:
+            if self.ipfs.cid_is_dir(cid):
+                children = [(self._visit, entry.cid) for entry in self.ipfs.ls_stream(cid)]
+                with self.lock:
+                    self.stats.dirs += 1
+                return children
+
+            size = self.ipfs.cid_size(cid)
+            with self.lock:
+                self.stats.files += 1
+                if self.mode != 'data':
+                    return []
+                if self.max_bytes is not None and self.reserved_bytes + size > self.max_bytes:
+                    self.stats.skipped_files += 1
+                    return []
+                self.reserved_bytes += size
+            return [(self._fetch_block, leaf_cid) for leaf_cid in self.ipfs.leaf_cids(cid, 0, size)]
+
+        except Exception:
+            logger.warning('prefetching %s failed', cid, exc_info=True)
+            with self.lock:
+                self.stats.errors += 1
+            return []
+
+    def _fetch_block(self, cid):
+        try:
+            size = len(self.ipfs.block(cid))
+        except Exception:
+            logger.warning('prefetching %s failed', cid, exc_info=True)
+            with self.lock:
+                self.stats.errors += 1
+        else:
+            with self.lock:
+                self.stats.bytes += size
+        return []
+
+
+def start_prefetch(ipfs, cid, **kwargs):
+    """ Run `Prefetcher` in a background thread, logging its progress. Returns the thread. """
+    def run():
+        logger.info('prefetching %s', cid)
+        prefetcher = Prefetcher(ipfs, progress=lambda p: logger.info('prefetch: %s', p), **kwargs)
+        logger.info('prefetch of %s done: %s', cid, prefetcher.run(cid))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
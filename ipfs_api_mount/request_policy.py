@@ -0,0 +1,109 @@
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import ipfshttpclient
+
+logger = logging.getLogger(__name__)
+
+HEDGE_MIN_SAMPLES = 100  # requests to an endpoint measured before its latency is trusted for hedging
+HEDGE_WORKERS = 64
+MIN_ATTEMPT_TIMEOUT = 0.01  # seconds, for an attempt started right before the deadline
+
+RETRIABLE_ERRORS = (
+    ipfshttpclient.exceptions.TimeoutError,
+    ipfshttpclient.exceptions.ConnectionError,
+)
+
+
+class RequestPolicy:
+    """ How daemon requests are made: timeouts, retries and hedging.
+
+    A request failing with timeout or connection error is retried up to
+    `retries` times, after exponentially growing, jittered delays starting
+    at `retry_backoff` seconds - as long as the timeout of the request
+    hasn't passed. It bounds all attempts together, so a hanging daemon
+    doesn't keep FUSE callers waiting any longer than without retries.
+
+    With `hedge_quantile` set, a request still running when the given
+    quantile of observed latency of its endpoint has passed is duplicated,
+    and whichever copy answers first wins. This trims the tail of latency
+    at the cost of a few more requests. """
+
+    def __init__(
+        self,
+        metrics,  # `Metrics` to measure requests in
+        timeout=30.0,  # in seconds
+        timeouts=None,  # {endpoint: seconds}, overriding `timeout`
+        retries=2,
+        retry_backoff=0.1,  # in seconds
+        hedge_quantile=None,  # like 0.95, None disables hedging
+    ):
+        self.metrics = metrics
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.hedge_quantile = hedge_quantile
+        self.executor = None if hedge_quantile is None else ThreadPoolExecutor(
+            max_workers=HEDGE_WORKERS,
+            thread_name_prefix='hedged-request',
+        )
+
+    def request(self, endpoint, fn, arg, hedge=True):
+        """ Make request `fn(arg, timeout=...)` to given API endpoint. All
+        attempts together, retries and hedges included, take at most the
+        timeout of the endpoint. """
+        deadline = time.monotonic() + self.timeouts.get(endpoint, self.timeout)
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(endpoint, fn, arg, hedge, deadline)
+            except RETRIABLE_ERRORS as e:
+                delay = self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                if attempt >= self.retries or time.monotonic() + delay >= deadline:
+                    raise
+                logger.debug('%s(%s) failed (%r), retrying in %.3fs', endpoint, arg, e, delay)
+                self.metrics.count_retry(endpoint)
+                time.sleep(delay)
+                attempt += 1
+
+    def _attempt(self, endpoint, fn, arg, hedge, deadline):
+        hedge_delay = self._hedge_delay(endpoint, deadline) if hedge else None
+        if hedge_delay is None:
+            return self._measured(endpoint, fn, arg, deadline)
+
+        first = self.executor.submit(self._measured, endpoint, fn, arg, deadline)
+        done, _ = wait([first], timeout=hedge_delay)
+        if done:
+            return first.result()
+
+        self.metrics.count_hedge(endpoint)
+        second = self.executor.submit(self._measured, endpoint, fn, arg, deadline)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.metrics.count_hedge_win(endpoint)
+                    return future.result()
+        # both failed
+        return first.result()
+
+    def _measured(self, endpoint, fn, arg, deadline):
+        with self.metrics.request(endpoint):
+            return fn(arg, timeout=max(deadline - time.monotonic(), MIN_ATTEMPT_TIMEOUT))
+
+    def _hedge_delay(self, endpoint, deadline):
+        if self.hedge_quantile is None:
+            return None
+        with self.metrics.lock:
+            histogram = self.metrics.requests.get(endpoint)
+            if histogram is None or histogram.count < HEDGE_MIN_SAMPLES:
+                return None
+            delay = histogram.quantile(self.hedge_quantile)
+        if delay >= deadline - time.monotonic():
+            return None
+        return delay
@@ -0,0 +1,104 @@
+import logging
+import sqlite3
+import threading
+
+from .cid import LIBP2P_KEY, parse_cid
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS attrs (cid BLOB PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS resolved (path TEXT PRIMARY KEY, cid TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS listings (
+    cid TEXT PRIMARY KEY,
+    names BLOB, cids BLOB, name_ends BLOB, cid_ends BLOB, types BLOB, sizes BLOB
+) WITHOUT ROWID;
+'''
+
+MMAP_SIZE = 1024 ** 3
+
+
+class MetadataSnapshot:
+    """ Metadata caches of `CachedIPFS` - attributes, resolved paths and
+    directory listings - saved in an SQLite database. Nothing is loaded up
+    front: entries are looked up when they miss the in-memory caches, so a
+    big snapshot doesn't slow down the start. The database is
+    memory-mapped, lookups are cheap.
+
+    Everything stored is immutable, so saving only adds entries. Only
+    paths starting with a CID are stored, IPNS names may change. """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.db.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        self.hits = 0
+        self.misses = 0
+        self.size = self._count()
+
+    def __len__(self):
+        return self.size
+
+    def attrs(self, cid_bytes):
+        """ Get packed attributes of an object, or `None`. """
+        row = self._get('SELECT value FROM attrs WHERE cid = ?', cid_bytes)
+        return None if row is None else row[0]
+
+    def resolved(self, path):
+        """ Get CID a path resolves to, or `None`. """
+        row = self._get('SELECT cid FROM resolved WHERE path = ?', path)
+        return None if row is None else row[0]
+
+    def listing(self, cid):
+        """ Get `DirListing` columns of a directory, or `None`. """
+        return self._get('SELECT names, cids, name_ends, cid_ends, types, sizes FROM listings WHERE cid = ?', cid)
+
+    def save(self, attrs, resolved, listings):
+        """ Store iterables of `(binary CID, packed attributes)`, `(path, CID)`
+        and `(CID, DirListing columns)`. """
+        with self.lock:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO attrs VALUES (?, ?)', attrs)
+                self.db.executemany('INSERT OR REPLACE INTO resolved VALUES (?, ?)', (
+                    (path, cid) for path, cid in resolved
+                    if cid is not None and is_immutable_path(path)
+                ))
+                self.db.executemany('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                    (cid, *columns) for cid, columns in listings
+                ))
+            self.size = self._count()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _get(self, query, key):
+        with self.lock:
+            row = self.db.execute(query, (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return row
+
+    def _count(self):
+        return sum(
+            self.db.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+            for table in ('attrs', 'resolved', 'listings')
+        )
+
+
+def is_immutable_path(path):
+    """ Check if a path starts with a CID (optionally after /ipfs/). """
+    parts = [part for part in path.split('/') if part]
+    if parts[:1] == ['ipfs']:
+        parts = parts[1:]
+    if not parts:
+        return False
+    try:
+        # IPNS keys are CIDs too
+        return parse_cid(parts[0]).codec != LIBP2P_KEY
+    except ValueError:
+        return False
@@ -7,7 +7,11 @@ from setuptools.command.develop import develop
 
 
 def compile_protobuf():
-    check_call(['protoc', '--python_out=.', 'ipfs_api_mount/unixfs.proto'])
+    check_call([
+        'protoc', '--python_out=.',
+        'ipfs_api_mount/unixfs.proto',
+        'ipfs_api_mount/merkledag.proto',
+    ])
 
 
 class custom_build_py(build_py):
@@ -38,8 +42,10 @@ setup(
     ],
     keywords='ipfs fuse mount fs',
     install_requires=[
+        'httpx>=0.18,<1',
         'ipfshttpclient==0.8.0a2',
         'lru-dict==1.*',
+        'mmh3>=3,<6',
         'protobuf>=3.15,<4',
         'py-multibase==1.*',
         'pyfuse3>=3.2.1,<4',
@@ -49,9 +55,14 @@ setup(
     scripts=[
         'bin/ipfs-api-mount',
         'bin/ipfs-api-mount-whole',
+        'bin/ipfs-api-mount-multi',
+        'bin/ipfs-api-mount-prefetch',
     ],
     package_data={
-        'ipfs_api_mount': ['ipfs_api_mount/unixfs.proto'],
+        'ipfs_api_mount': [
+            'ipfs_api_mount/unixfs.proto',
+            'ipfs_api_mount/merkledag.proto',
+        ],
     },
     cmdclass={
         'build_py': custom_build_py,
@@ -0,0 +1,16 @@
+import trio
+
+from ipfs_api_mount.async_client import AsyncIPFSClient, TrioIPFSClient
+
+
+def test_connection_pools_closed():
+    async_client = AsyncIPFSClient('http://127.0.0.1:5001/api/v0')
+    first = trio.run(async_client._get_http)
+    assert trio.run(async_client._get_http) is not first  # another event loop, another pool
+    assert first.is_closed
+
+    second = async_client._http
+    with TrioIPFSClient(async_client):
+        pass
+    assert second.is_closed
+    assert async_client._http is None
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import ipfshttpclient
+import pytest
+
+from ipfs_api_mount.balancer import BalancedClient
+
+CID = 'QmXKqqUymTQpEM89M15G23wot8g7n1qVYQQ6vVCpEofYSe'
+
+
+class FakeClient:
+    def __init__(self, name):
+        self.name = name
+        self.down = False
+        self.requests = []
+        self.block = SimpleNamespace(get=self.request, stat=self.request)
+
+    def request(self, arg, **kwargs):
+        if self.down:
+            raise ipfshttpclient.exceptions.ConnectionError(None)
+        self.requests.append(arg)
+        return self.name
+
+    def resolve(self, path, **kwargs):
+        return self.request(path)
+
+    def version(self, **kwargs):
+        return self.request(None)
+
+    def ls(self, path, stream=False, **kwargs):
+        # lazy, like `TrioIPFSClient` - nothing happens until iterated
+        yield self.request(path)
+        yield self.name
+
+
+def balanced(strategy='least-requests', n=3):
+    clients = {str(i): FakeClient(str(i)) for i in range(n)}
+    return BalancedClient(clients, strategy=strategy, health_check_interval=None), clients
+
+
+def test_least_requests():
+    client, clients = balanced()
+    for _ in range(6):
+        client.block.get(CID)
+    assert [len(c.requests) for c in clients.values()] == [2, 2, 2]
+
+
+def test_hash():
+    client, _ = balanced('hash')
+    # the same CID goes to the same daemon, whatever the path
+    chosen = client.block.get(CID)
+    assert client.resolve(f'/ipfs/{CID}/a/b') == chosen
+    assert client.block.stat(CID) == chosen
+    # different CIDs are spread
+    assert len({client.block.get(f'{CID}{i}') for i in range(20)}) > 1
+
+
+def test_failover_and_health_check():
+    client, clients = balanced()
+    clients['0'].down = True
+
+    for _ in range(10):
+        assert client.block.get(CID) in ('1', '2')
+    ejected = client.endpoints[0]
+    assert not ejected.healthy
+
+    clients['0'].down = False
+    client._health_check(ejected)
+    assert ejected.healthy
+
+
+def test_all_down():
+    client, clients = balanced()
+    for c in clients.values():
+        c.down = True
+    with pytest.raises(ipfshttpclient.exceptions.ConnectionError):
+        client.block.get(CID)
+
+
+def test_ls_stream_failover():
+    client, clients = balanced()
+    clients['0'].down = True
+    for _ in range(10):
+        responses = list(client.ls(CID, stream=True))
+        assert len(responses) == 2 and responses[0] in ('1', '2')
+    assert not client.endpoints[0].healthy
+    assert all(endpoint.in_flight == 0 for endpoint in client.endpoints)
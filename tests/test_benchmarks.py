@@ -0,0 +1,16 @@
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(__file__), '..', 'benchmarks')
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import run  # noqa: E402
+
+
+def test_request_counts():
+    """ Daemon requests made by the quick benchmark scenarios are not above the stored baseline """
+    assert run.main([
+        '--direct', '--latency', '0',
+        '--baseline', os.path.join(BENCHMARKS_DIR, 'baseline.json'),
+        'sequential_read', 'random_read', 'list_wide_tree', 'repeated_getattr',
+    ]) == 0
@@ -0,0 +1,43 @@
+import os
+
+from tools import ipfs_client, ipfs_dir, ipfs_file
+
+from ipfs_api_mount.car import CarClient
+
+
+def export_car(root, path):
+    with open(path, 'wb') as f:
+        f.write(ipfs_client.dag.export(root))
+
+
+def test_car_mount(ipfs_mounted, tmp_path):
+    content = os.urandom(1024 * 1024)
+    root = ipfs_dir({
+        'dir': ipfs_dir({
+            'small': ipfs_file(b'small file'),
+        }),
+        'big': ipfs_file(content, raw_leaves=True),
+    })
+    car_path = str(tmp_path / 'dag.car')
+    export_car(root, car_path)
+
+    with ipfs_mounted(
+        root, CarClient([car_path]),
+    ) as mountpoint:
+        assert sorted(os.listdir(mountpoint)) == ['big', 'dir']
+        assert not os.path.exists(os.path.join(mountpoint, 'nonexistent'))
+        assert os.stat(os.path.join(mountpoint, 'big')).st_size == len(content)
+        with open(os.path.join(mountpoint, 'big'), 'rb') as f:
+            assert f.read() == content
+        with open(os.path.join(mountpoint, 'dir', 'small'), 'rb') as f:
+            assert f.read() == b'small file'
+
+
+def test_car_index(tmp_path):
+    root = ipfs_dir({'file': ipfs_file(b'content')})
+    car_path = str(tmp_path / 'dag.car')
+    export_car(root, car_path)
+
+    index = CarClient([car_path], save_index=True).index
+    assert os.path.exists(car_path + '.index')
+    assert CarClient([car_path]).index == index
@@ -0,0 +1,52 @@
+import multibase
+import pytest
+
+from ipfs_api_mount.cid import DAG_PB, IDENTITY, RAW, cid_to_str, parse_cid
+from ipfs_api_mount.ipfs import CachedIPFS
+
+
+@pytest.mark.parametrize('cid', [
+    'QmXKqqUymTQpEM89M15G23wot8g7n1qVYQQ6vVCpEofYSe',
+    'bafybeiczsscdsbs7ffqz55asqdf3smv6klcw3gofszvwlyarci47bgf354',
+    'bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku',
+])
+def test_cid_to_str(cid):
+    if cid.startswith('Qm'):
+        # v0 is base58 without multibase prefix
+        cid_bytes = multibase.decode('z' + cid)
+    else:
+        cid_bytes = multibase.decode(cid)
+    assert cid_to_str(cid_bytes) == cid
+
+
+def test_parse_cid():
+    v0 = parse_cid('QmXKqqUymTQpEM89M15G23wot8g7n1qVYQQ6vVCpEofYSe')
+    assert (v0.version, v0.codec, v0.is_inline) == (0, DAG_PB, False)
+    assert len(v0.digest) == 32
+
+    v1 = parse_cid('bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku')
+    assert (v1.version, v1.codec, v1.codec_name) == (1, RAW, 'raw')
+    assert v1.multihash == v1.bytes[2:]
+
+    # decoded only once
+    assert parse_cid(str(v1)) is v1
+
+
+@pytest.mark.parametrize('cid', ['', 'Qm', 'bafy', 'not a cid'])
+def test_parse_malformed_cid(cid):
+    with pytest.raises(ValueError):
+        parse_cid(cid)
+
+
+def test_read_inline_block():
+    data = b'small enough to be inlined'
+    cid = cid_to_str(bytes([0x01, RAW, IDENTITY, len(data)]) + data)
+    assert parse_cid(cid).is_inline
+
+    # no daemon needed
+    ipfs = CachedIPFS(None)
+    assert not ipfs.has_attrs(cid)
+    assert ipfs.cid_size(cid) == len(data)
+    assert ipfs.has_attrs(cid)
+    assert ipfs.read(cid, 6, 6) == b'enough'
+    assert ipfs.metrics.requests == {}
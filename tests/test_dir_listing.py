@@ -0,0 +1,45 @@
+from ipfs_api_mount.ipfs import DirEntry, DirListing
+
+
+def dir_entry(name, cid='QmSomeHash', type=2, size=0):
+    return DirEntry(name=name, cid=cid, type=type, size=size)
+
+
+def test_order_is_kept():
+    listing = DirListing([
+        dir_entry('b', 'Qmb', size=2),
+        dir_entry('ą', 'bafyą', type=1),
+        dir_entry('a', 'Qma', size=1),
+    ])
+    assert len(listing) == 3
+    assert list(listing) == [
+        DirEntry(name='b', cid='Qmb', type=2, size=2),
+        DirEntry(name='ą', cid='bafyą', type=1, size=0),
+        DirEntry(name='a', cid='Qma', type=2, size=1),
+    ]
+
+
+def test_find():
+    names = [f'entry{i}' for i in reversed(range(1000))]
+    listing = DirListing([dir_entry(name, f'Qm{name}') for name in names])
+    for name in names:
+        assert listing[listing.find(name)].cid == f'Qm{name}'
+    assert listing.find('') is None
+    assert listing.find('entry') is None
+    assert listing.find('entry1000') is None
+    assert listing.find('zzz') is None
+
+
+def test_empty():
+    listing = DirListing([])
+    assert len(listing) == 0
+    assert list(listing) == []
+    assert listing.find('a') is None
+
+
+def test_columns():
+    listing = DirListing([dir_entry(f'entry{i}', f'Qm{i}') for i in range(10)])
+    restored = DirListing.from_columns(listing.to_columns())
+    assert list(restored) == list(listing)
+    assert restored.find('entry5') == 5
+    assert restored.find('entry55') is None
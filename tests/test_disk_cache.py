@@ -0,0 +1,118 @@
+import errno
+import os
+from unittest import mock
+
+import pytest
+
+from ipfs_api_mount.disk_cache import DiskCache
+
+
+def test_put_get(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    assert cache.get('QmA') is None
+    cache.put('QmA', {'a': [1, 2]}, b'payload')
+    metadata, payload = cache.get('QmA')
+    assert metadata == {'a': [1, 2]}
+    assert bytes(payload) == b'payload'
+
+
+def test_survives_restart(tmp_path):
+    DiskCache(str(tmp_path), 1024).put('QmA', {}, b'payload')
+    metadata, payload = DiskCache(str(tmp_path), 1024).get('QmA')
+    assert bytes(payload) == b'payload'
+
+
+def test_size_limit(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    cache.put('QmA', {}, 400 * b'a')
+    cache.put('QmB', {}, 400 * b'b')
+    cache.get('QmA')  # 'QmA' is now most recently used
+    cache.put('QmC', {}, 400 * b'c')
+    assert cache.get('QmA') is not None
+    assert cache.get('QmB') is None
+    assert cache.get('QmC') is not None
+    assert cache.bytes <= 1024
+
+    # smaller limit after restart
+    cache = DiskCache(str(tmp_path), 500)
+    assert cache.get('QmA') is None
+    assert cache.get('QmC') is not None
+
+
+def test_corrupted_file(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    cache.put('QmA', {}, b'payload')
+    with open(cache._file_path('QmA'), 'wb') as f:
+        f.write(b'garbage')
+    assert cache.get('QmA') is None
+    assert not os.path.exists(cache._file_path('QmA'))
+
+
+def test_interrupted_write_is_cleaned_up(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    cache.put('QmA', {}, b'payload')
+    tmp_file_path = cache._file_path('QmB') + '.123.tmp'
+    os.makedirs(os.path.dirname(tmp_file_path), exist_ok=True)
+    with open(tmp_file_path, 'wb') as f:
+        f.write(b'half written')
+
+    cache = DiskCache(str(tmp_path), 1024)
+    assert not os.path.exists(tmp_file_path)
+    assert cache.get('QmB') is None
+    assert cache.get('QmA') is not None
+
+
+def test_foreign_files_are_left_alone(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    cache.put('QmA', {}, b'payload')
+    foreign = [
+        tmp_path / 'notes.tmp',
+        tmp_path / 'QmB',
+        tmp_path / 'mA' / 'QmA.txt',
+        tmp_path / 'mA' / 'QmA.backup.tmp',
+        tmp_path / 'mA' / 'QmB.123.tmp',
+        tmp_path / 'sub' / 'dir' / 'QmC',
+    ]
+    for path in foreign:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(2000 * b'x')
+
+    cache = DiskCache(str(tmp_path), 1024)
+    assert len(cache) == 1
+    assert cache.get('QmA') is not None
+    assert all(path.exists() for path in foreign)
+
+
+def test_refuses_untagged_directory(tmp_path):
+    (tmp_path / 'important').write_bytes(b'data')
+    with pytest.raises(ValueError):
+        DiskCache(str(tmp_path), 1024)
+    assert os.listdir(tmp_path) == ['important']
+
+
+def test_read_error_keeps_file(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    cache.put('QmA', {}, b'payload')
+    with mock.patch('builtins.open', side_effect=OSError(errno.EMFILE, 'Too many open files')):
+        assert cache.get('QmA') is None
+    assert bytes(cache.get('QmA')[1]) == b'payload'
+
+
+def test_write_error_is_ignored(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    with mock.patch('os.replace', side_effect=OSError(errno.ENOSPC, 'No space left on device')):
+        cache.put('QmA', {}, b'payload')
+    assert cache.get('QmA') is None
+    assert cache.bytes == 0
+    assert not os.path.exists(cache._file_path('QmA'))
+    assert os.listdir(os.path.dirname(cache._file_path('QmA'))) == []
+
+
+def test_payloads_dont_hold_file_descriptors(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024 ** 2)
+    for i in range(50):
+        cache.put(f'Qm{i}', {}, b'payload')
+    fds = len(os.listdir('/proc/self/fd'))
+    payloads = [cache.get(f'Qm{i}')[1] for i in range(50)]
+    assert len(os.listdir('/proc/self/fd')) == fds
+    assert all(bytes(payload) == b'payload' for payload in payloads)
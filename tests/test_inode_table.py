@@ -0,0 +1,53 @@
+import hashlib
+from unittest import mock
+
+from ipfs_api_mount.cid import cid_to_str
+from ipfs_api_mount.fuse_operations import high
+from ipfs_api_mount.fuse_operations.high import InodeTable
+
+CID_A = 'QmXKqqUymTQpEM89M15G23wot8g7n1qVYQQ6vVCpEofYSe'
+CID_B = 'bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku'
+RAW_CID_PREFIX = bytes([0x01, 0x55, 0x12, 0x20])  # v1, raw, sha2-256
+
+
+def test_lookup_and_forget():
+    inodes = InodeTable(first_free=3)
+    inodes.set(1, CID_A)
+
+    ino = inodes.lookup(CID_B)
+    assert ino == 3
+    assert inodes.lookup(CID_B) == ino
+    assert inodes.lookup(CID_A) == 1
+    assert inodes.cid(ino) == CID_B
+    assert len(inodes) == 2
+
+    inodes.forget(ino, 1)
+    assert inodes.cid(ino) == CID_B
+    inodes.forget(ino, 1)
+    assert len(inodes) == 1
+
+    # number of forgotten inode is reused
+    assert inodes.lookup('QmSnuWmxptJZdLJpKRarxBMS2Ju2oANVrgbr2xWbie9b2D') == ino
+
+
+def test_cid_strings_cached():
+    inodes = InodeTable(first_free=3)
+    ino = inodes.lookup(CID_A)
+    with mock.patch.object(high, 'cid_to_str', wraps=high.cid_to_str) as encode:
+        for _ in range(10):
+            assert inodes.cid(ino) == CID_A
+        assert encode.call_count == 1
+
+        # reused inode number gets the new CID
+        inodes.forget(ino, 1)
+        assert inodes.lookup(CID_B) == ino
+        assert inodes.cid(ino) == CID_B
+        assert encode.call_count == 2
+
+    # only recently used ones are kept
+    for i in range(high.CID_STR_CACHE_SIZE + 10):
+        cid = cid_to_str(RAW_CID_PREFIX + hashlib.sha256(str(i).encode()).digest())
+        assert inodes.cid(inodes.lookup(cid)) == cid
+    assert len(inodes.cid_strs) == high.CID_STR_CACHE_SIZE
+    assert ino not in inodes.cid_strs
+    assert inodes.cid(ino) == CID_B
@@ -0,0 +1,80 @@
+import time
+from unittest import mock
+
+import ipfshttpclient
+import pytest
+
+from ipfs_api_mount.ipfs import CachedIPFS
+
+CID_A = 'QmXoypizjW3WknFiJnKLwHCnL72vedxjQkDDP1mXWo6uco'
+CID_B = 'QmXKqqUymTQpEM89M15G23wot8g7n1qVYQQ6vVCpEofYSe'
+
+
+def resolving_client(*paths):
+    client = mock.Mock()
+    client.resolve.side_effect = [{'Path': path} for path in paths]
+    return client
+
+
+def wait_for_calls(fn, n):
+    deadline = time.monotonic() + 5
+    while fn.call_count < n:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_immutable_path_cached_for_good():
+    client = resolving_client(f'/ipfs/{CID_A}/a')
+    ipfs = CachedIPFS(client, ipns_ttl=0)
+    assert ipfs.resolve(f'{CID_A}/a') == f'{CID_A}/a'
+    assert ipfs.resolve(f'{CID_A}/a') == f'{CID_A}/a'
+    assert client.resolve.call_count == 1
+
+
+def test_mutable_path_fresh():
+    client = resolving_client(f'/ipfs/{CID_A}')
+    ipfs = CachedIPFS(client, ipns_ttl=60)
+    assert ipfs.resolve('/ipns/example.com') == CID_A
+    assert ipfs.resolve('/ipns/example.com') == CID_A
+    assert client.resolve.call_count == 1
+
+
+def test_mutable_path_stale_while_refreshed():
+    client = resolving_client(f'/ipfs/{CID_A}', f'/ipfs/{CID_B}')
+    ipfs = CachedIPFS(client, ipns_ttl=0)
+    assert ipfs.resolve('/ipns/example.com') == CID_A
+    time.sleep(0.01)
+    # expired - old value served, new one fetched in background
+    assert ipfs.resolve('/ipns/example.com') == CID_A
+    wait_for_calls(client.resolve, 2)
+    ipfs.ipns_executor.shutdown(wait=True)
+    assert ipfs.ipns_cache.get('/ipns/example.com')[1][0] == CID_B
+
+
+def test_mutable_path_too_stale():
+    client = resolving_client(f'/ipfs/{CID_A}', f'/ipfs/{CID_B}')
+    ipfs = CachedIPFS(client, ipns_ttl=0, ipns_max_stale=0)
+    assert ipfs.resolve('/ipns/example.com') == CID_A
+    time.sleep(0.01)
+    assert ipfs.resolve('/ipns/example.com') == CID_B
+
+
+def test_missing_path_cached():
+    client = mock.Mock()
+    client.resolve.side_effect = ipfshttpclient.exceptions.ErrorResponse(f'no link named "a" under {CID_A}', None)
+    ipfs = CachedIPFS(client)
+    assert ipfs.resolve(f'{CID_A}/a') is None
+    assert ipfs.resolve(f'{CID_A}/a') is None
+    assert client.resolve.call_count == 1
+
+
+def test_failed_resolution_not_cached():
+    client = mock.Mock()
+    client.resolve.side_effect = [
+        ipfshttpclient.exceptions.ErrorResponse('context deadline exceeded', None),
+        {'Path': f'/ipfs/{CID_B}'},
+    ]
+    ipfs = CachedIPFS(client)
+    with pytest.raises(ipfshttpclient.exceptions.ErrorResponse):
+        ipfs.resolve(f'{CID_A}/a')
+    assert ipfs.resolve(f'{CID_A}/a') == CID_B
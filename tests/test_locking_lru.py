@@ -0,0 +1,42 @@
+from ipfs_api_mount.ipfs import LockingLRU
+
+
+def test_max_size():
+    cache = LockingLRU(2)
+    cache['a'] = b'a'
+    cache['b'] = b'b'
+    cache['c'] = b'c'
+    assert cache.get('a') == (False, None)
+    assert cache.get('b') == (True, b'b')
+    assert cache.get('c') == (True, b'c')
+
+
+def test_max_bytes():
+    cache = LockingLRU(max_bytes=10)
+    cache['a'] = b'12345'
+    cache['b'] = b'1234'
+    assert cache.get('a') == (True, b'12345')  # 'a' is now most recently used
+    cache['c'] = b'12'
+    assert cache.get('a') == (True, b'12345')
+    assert cache.get('b') == (False, None)
+    assert cache.get('c') == (True, b'12')
+
+
+def test_max_bytes_value_too_big():
+    cache = LockingLRU(max_bytes=10)
+    cache['a'] = b'1234'
+    cache['b'] = 11 * b'x'
+    assert cache.get('a') == (False, None)
+    assert cache.get('b') == (False, None)
+
+
+def test_statistics():
+    cache = LockingLRU(2)
+    with cache.get_or_lock('a') as (in_cache, _):
+        assert not in_cache
+        cache['a'] = b'a'
+    with cache.get_or_lock('a') as (in_cache, _):
+        assert in_cache
+    assert cache.get('b') == (False, None)
+    assert (cache.hits, cache.misses, cache.waits) == (1, 2, 0)
+    assert len(cache) == 1
@@ -0,0 +1,50 @@
+import errno
+from unittest import mock
+
+import ipfshttpclient
+import pyfuse3
+import pytest
+import trio
+
+from ipfs_api_mount.fuse_operations import IPFSOperations, WholeIPFSOperations
+
+ROOT = 'QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn'  # empty directory
+CHILD = 'QmXoypizjW3WknFiJnKLwHCnL72vedxjQkDDP1mXWo6uco'
+
+
+def operations(resolve_error):
+    client = mock.Mock()
+    client.resolve.side_effect = [{'Path': f'/ipfs/{ROOT}'}, resolve_error]
+    client.block.get.return_value = bytes.fromhex('0a020801')  # empty unixfs directory
+    return IPFSOperations(ROOT, client, negative_timeout=1000, retries=0)
+
+
+def test_missing_entry_cached():
+    ops = operations(ipfshttpclient.exceptions.ErrorResponse(f'no link named "a" under {ROOT}', None))
+    attrs = trio.run(ops.lookup, pyfuse3.ROOT_INODE, b'a', None)
+    assert (attrs.st_ino, attrs.entry_timeout) == (0, 1000)
+
+
+@pytest.mark.parametrize('error, errno_', [
+    (ipfshttpclient.exceptions.ErrorResponse('context deadline exceeded', None), errno.EIO),
+    (ipfshttpclient.exceptions.TimeoutError(None), errno.EAGAIN),
+])
+def test_failed_lookup_not_cached(error, errno_):
+    ops = operations(error)
+    with pytest.raises(pyfuse3.FUSEError) as e:
+        trio.run(ops.lookup, pyfuse3.ROOT_INODE, b'a', None)
+    assert e.value.errno == errno_
+
+
+@pytest.mark.parametrize('name, entry_timeout', [
+    (ROOT, 1000),  # immutable
+    ('example.com', 60),  # DNSLink, may change
+])
+def test_whole_mode_root_entry_timeout(name, entry_timeout):
+    client = mock.Mock()
+    client.resolve.return_value = {'Path': f'/ipfs/{ROOT}'}
+    client.block.get.return_value = bytes.fromhex('0a020801')  # empty unixfs directory
+    ops = WholeIPFSOperations(client, entry_timeout=1000, root_entry_timeout=60, retries=0)
+    attrs = trio.run(ops.lookup, pyfuse3.ROOT_INODE, name.encode(), None)
+    assert attrs.st_ino != 0
+    assert attrs.entry_timeout == entry_timeout
@@ -0,0 +1,42 @@
+import pytest
+
+from ipfs_api_mount.ipfs import LockingLRU
+from ipfs_api_mount.metrics import Histogram, Metrics
+
+
+def test_histogram_quantile():
+    histogram = Histogram()
+    for _ in range(90):
+        histogram.observe(0.002)
+    for _ in range(10):
+        histogram.observe(0.2)
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.0025
+    assert histogram.quantile(0.99) == 0.25
+
+
+def test_request_errors():
+    metrics = Metrics()
+    with metrics.request('ls'):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.request('ls'):
+            raise ValueError()
+    assert metrics.requests['ls'].count == 2
+    assert metrics.request_errors['ls'] == 1
+    assert metrics.requests_in_flight == 0
+
+
+def test_render_prometheus():
+    metrics = Metrics()
+    cache = LockingLRU(2)
+    cache.get('a')
+    metrics.caches['block'] = cache
+    with metrics.request('block/get'):
+        pass
+
+    lines = metrics.render_prometheus().splitlines()
+    assert 'ipfs_api_mount_cache_misses_total{cache="block"} 1' in lines
+    assert 'ipfs_api_mount_daemon_requests_in_flight 0' in lines
+    assert 'ipfs_api_mount_daemon_request_duration_seconds_count{endpoint="block/get"} 1' in lines
+    assert 'ipfs_api_mount_daemon_request_duration_seconds_bucket{endpoint="block/get",le="+Inf"} 1' in lines
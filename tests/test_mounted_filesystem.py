@@ -1,5 +1,6 @@
 import errno
 import os
+import random
 from unittest import mock
 
 import ipfshttpclient
@@ -7,6 +8,7 @@ import pytest
 from tools import ipfs_client, ipfs_dir, ipfs_file
 
 import ipfs_api_mount
+from ipfs_api_mount.async_client import AsyncIPFSClient, TrioIPFSClient
 from ipfs_api_mount.fuse_operations import IPFSOperations
 from ipfs_api_mount.ipfs import InvalidIPFSPathException
 
@@ -23,6 +25,23 @@ def test_dir_read(ipfs_mounted, entries):
         assert sorted(os.listdir(mountpoint)) == sorted(entries)
 
 
+def test_dir_read_many_entries(ipfs_mounted):
+    """ Big listing is passed to the kernel in many pages """
+    entries = {f'file{i}': ipfs_file(f'content {i}'.encode()) for i in range(1000)}
+    root = ipfs_dir({'dir': ipfs_dir(entries)})
+    with ipfs_mounted(
+        root, ipfs_client,
+    ) as mountpoint:
+        path = os.path.join(mountpoint, 'dir')
+        assert sorted(os.listdir(path)) == sorted(entries)
+        # listed again from cache
+        assert sorted(os.listdir(path)) == sorted(entries)
+        with os.scandir(path) as it:
+            assert {entry.name: entry.stat().st_size for entry in it} == {
+                f'file{i}': len(f'content {i}') for i in range(1000)
+            }
+
+
 def test_dir_read_on_file(ipfs_mounted):
     """ It's not possible to listdir a file. """
     root = ipfs_dir({
@@ -100,6 +119,72 @@ def test_file_read(ipfs_mounted, content, raw_leaves, cid_version):
             assert f.read() == content
 
 
+@pytest.mark.parametrize('raw_leaves', [False, True])
+def test_file_random_read(ipfs_mounted, raw_leaves):
+    # small chunks, so the file is a tree with multiple levels
+    content = os.urandom(512 * 1024)
+    root = ipfs_dir({'file': ipfs_file(
+        content,
+        chunker='size-1024',
+        raw_leaves=raw_leaves,
+    )})
+    with ipfs_mounted(
+        root, ipfs_client,
+    ) as mountpoint:
+        fd = os.open(os.path.join(mountpoint, 'file'), os.O_RDONLY)
+        try:
+            for _ in range(100):
+                offset = random.randrange(len(content) + 1024)
+                size = random.randrange(1, 8192)
+                assert os.pread(fd, size, offset) == content[offset:(offset + size)]
+        finally:
+            os.close(fd)
+
+
+def test_async_client(ipfs_mounted):
+    content = os.urandom(1024 * 1024)
+    root = ipfs_dir({
+        'dir': ipfs_dir({}),
+        'file': ipfs_file(content),
+    })
+    async_client = TrioIPFSClient(AsyncIPFSClient('http://127.0.0.1:5001/api/v0'))
+    with ipfs_mounted(
+        root, async_client,
+    ) as mountpoint:
+        assert sorted(os.listdir(mountpoint)) == ['dir', 'file']
+        assert not os.path.exists(os.path.join(mountpoint, 'nonexistent'))
+        with open(os.path.join(mountpoint, 'file'), 'rb') as f:
+            assert f.read() == content
+
+
+def test_stats_file():
+    """ Statistics are available in a hidden file, not listed in root dir. """
+    root = ipfs_dir({'a_file': ipfs_file(b'some content')})
+    with ipfs_api_mount.ipfs_mounted(
+        IPFSOperations(root, ipfs_client),
+    ) as mountpoint:
+        with open(os.path.join(mountpoint, 'a_file'), 'rb') as f:
+            f.read()
+        assert os.listdir(mountpoint) == ['a_file']
+        with open(os.path.join(mountpoint, '.ipfs-api-mount-stats'), 'rt') as f:
+            stats = f.read()
+        assert 'block/get' in stats
+        assert 'block ' in stats
+
+
+@pytest.mark.parametrize('negative_timeout', [0, 60])
+def test_negative_lookup_cache(negative_timeout):
+    """ Kernel remembers missing names, if we let it """
+    root = ipfs_dir({})
+    operations = IPFSOperations(root, ipfs_client, negative_timeout=negative_timeout)
+    with ipfs_api_mount.ipfs_mounted(operations) as mountpoint:
+        path = os.path.join(mountpoint, 'nonexistent')
+        assert not os.path.exists(path)
+        lookup_count = operations.metrics.fuse_ops['lookup'].count
+        assert not os.path.exists(path)
+        assert operations.metrics.fuse_ops['lookup'].count - lookup_count == (0 if negative_timeout else 1)
+
+
 def test_root_hash_invalid():
     """ we should refuse to mount invalid hash """
     with pytest.raises(InvalidIPFSPathException):
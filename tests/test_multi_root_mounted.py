@@ -0,0 +1,50 @@
+import os
+
+import pytest
+from tools import ipfs_client, ipfs_dir, ipfs_file
+
+from ipfs_api_mount import ipfs_mounted
+from ipfs_api_mount.commands import read_roots_file
+from ipfs_api_mount.fuse_operations import MultiRootIPFSOperations
+from ipfs_api_mount.ipfs import InvalidIPFSPathException
+
+
+def test_roots():
+    shared = ipfs_file(b'shared content')
+    a = ipfs_dir({'shared': shared, 'only_a': ipfs_file(b'a')})
+    b = ipfs_dir({'shared': shared})
+    with ipfs_mounted(
+        MultiRootIPFSOperations({'a': a, 'b': f'/ipfs/{b}'}, ipfs_client),
+    ) as mountpoint:
+        assert sorted(os.listdir(mountpoint)) == ['a', 'b']
+        assert sorted(os.listdir(os.path.join(mountpoint, 'a'))) == ['only_a', 'shared']
+        with open(os.path.join(mountpoint, 'b', 'shared'), 'rb') as f:
+            assert f.read() == b'shared content'
+        # the same content is the same inode
+        assert os.stat(os.path.join(mountpoint, 'a', 'shared')).st_ino == os.stat(os.path.join(mountpoint, 'b', 'shared')).st_ino
+        assert not os.path.exists(os.path.join(mountpoint, 'c'))
+
+
+def test_set_roots():
+    a = ipfs_dir({'file': ipfs_file(b'a')})
+    operations = MultiRootIPFSOperations({'a': a}, ipfs_client, root_entry_timeout=0)
+    with ipfs_mounted(operations) as mountpoint:
+        operations.set_roots({'b': a})
+        assert os.listdir(mountpoint) == ['b']
+        assert os.listdir(os.path.join(mountpoint, 'b')) == ['file']
+        assert not os.path.exists(os.path.join(mountpoint, 'a'))
+
+        # invalid roots don't replace current ones
+        with pytest.raises(InvalidIPFSPathException):
+            operations.set_roots({'c': ipfs_file(b'not a dir')})
+        assert os.listdir(mountpoint) == ['b']
+
+
+def test_read_roots_file(tmp_path):
+    path = tmp_path / 'roots'
+    path.write_text('# comment\na /ipfs/QmA\n\nb   QmB  # trailing comment\n')
+    assert read_roots_file(path) == {'a': '/ipfs/QmA', 'b': 'QmB'}
+
+    path.write_text('a\n')
+    with pytest.raises(ValueError):
+        read_roots_file(path)
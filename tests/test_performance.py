@@ -1,11 +1,13 @@
 import os
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-import pytest
+import ipfshttpclient
 from tools import ipfs_client, ipfs_dir, ipfs_file, request_count_measurement
 
 
-@pytest.mark.skip(reason='max_read seems broken - https://github.com/libfuse/pyfuse3/issues/49')
 def test_file_read(ipfs_mounted):
     """ Reading a file causes at most as many requests as there are blocks in the file. """
     chunk_count = 100
@@ -16,14 +18,12 @@ def test_file_read(ipfs_mounted):
     with ipfs_mounted(
         root, ipfs_client,
         link_cache_size=4,
-        fuse_kwargs=dict(
-            max_read=chunk_size,  # prevent FUSE from doing large reads to exagerate cache effects
-        ),
+        read_ahead=0,  # blocks fetched in advance could be evicted from block cache before read
     ) as mountpoint:
         with request_count_measurement(ipfs_client) as mocked_request:
 
             with open(os.path.join(mountpoint, 'file'), 'rb') as f:
-                f.read()
+                assert f.read() == content
 
             assert mocked_request.call_count >= chunk_count
             assert mocked_request.call_count < 1.2 * chunk_count
@@ -62,3 +62,131 @@ def test_file_attribute_cache(ipfs_mounted):
         with request_count_measurement(ipfs_client) as mocked:
             subprocess.run(['ls', '-l', mountpoint], **ls_kwargs)
             assert mocked.call_count < n * 0.1
+
+
+def test_listing_attributes(ipfs_mounted):
+    """ Attributes of files come with directory listing, without a request per file """
+    n = 100
+    root = ipfs_dir({
+        'dir': ipfs_dir({
+            str(i): ipfs_file(b'conent' + str(i).encode('ascii'))
+            for i in range(n)
+        }),
+    })
+    with ipfs_mounted(
+        root, ipfs_client,
+    ) as mountpoint:
+        with request_count_measurement(ipfs_client) as mocked:
+            subprocess.run(
+                ['ls', '-l', os.path.join(mountpoint, 'dir')],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+            )
+            assert mocked.call_count < n * 0.1
+
+
+def test_lookup_from_listing(ipfs_mounted):
+    """ Entries of listed directory are looked up without resolving paths in the daemon """
+    n = 100
+    root = ipfs_dir({
+        'dir': ipfs_dir({
+            str(i): ipfs_file(b'conent' + str(i).encode('ascii'))
+            for i in range(n)
+        }),
+    })
+    with ipfs_mounted(
+        root, ipfs_client,
+    ) as mountpoint:
+        os.listdir(os.path.join(mountpoint, 'dir'))
+        with mock.patch.object(ipfs_client, 'resolve', wraps=ipfs_client.resolve) as resolve:
+            for i in range(n):
+                os.stat(os.path.join(mountpoint, 'dir', str(i)))
+            assert not os.path.exists(os.path.join(mountpoint, 'dir', 'nonexistent'))
+            resolve.assert_not_called()
+
+
+def test_concurrent_reads(ipfs_mounted):
+    """ Slow daemon request doesn't stall reads of other files """
+    n = 8
+    delay = 0.5
+    root = ipfs_dir({
+        str(i): ipfs_file(os.urandom(2048), chunker='size-1024')
+        for i in range(n)
+    })
+    original_request = ipfs_client._client._request
+
+    def slow_request(*args, **kwargs):
+        time.sleep(delay)
+        return original_request(*args, **kwargs)
+
+    with ipfs_mounted(
+        root, ipfs_client,
+        threads=n,
+    ) as mountpoint:
+        fds = [
+            os.open(os.path.join(mountpoint, str(i)), os.O_RDONLY)
+            for i in range(n)
+        ]
+        try:
+            with mock.patch.object(
+                ipfshttpclient.http._backend.ClientSync,
+                '_request',
+                side_effect=slow_request,
+            ):
+                start = time.monotonic()
+                with ThreadPoolExecutor(n) as executor:
+                    list(executor.map(lambda fd: os.pread(fd, 1, 0), fds))
+                elapsed = time.monotonic() - start
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    assert elapsed < n * delay / 2
+
+
+def test_read_ahead(ipfs_mounted):
+    """ Sequential read doesn't wait for every block separately """
+    chunk_size = 64 * 1024
+    content = os.urandom(chunk_size * 32)
+    root = ipfs_dir({'file': ipfs_file(content, chunker=f'size-{chunk_size}')})
+    original_request = ipfs_client._client._request
+
+    def slow_request(*args, **kwargs):
+        time.sleep(0.05)
+        return original_request(*args, **kwargs)
+
+    def read_time(read_ahead):
+        with ipfs_mounted(
+            root, ipfs_client,
+            read_ahead=read_ahead,
+            block_cache_size=64,
+        ) as mountpoint:
+            with open(os.path.join(mountpoint, 'file'), 'rb') as f:
+                with mock.patch.object(
+                    ipfshttpclient.http._backend.ClientSync,
+                    '_request',
+                    side_effect=slow_request,
+                ):
+                    start = time.monotonic()
+                    assert f.read() == content
+                    return time.monotonic() - start
+
+    assert read_time(1024 * 1024) < read_time(0) / 2
+
+
+def test_disk_cache(ipfs_mounted, tmp_path):
+    """ Blocks are read from disk cache after remount """
+    content = os.urandom(1024 * 1024)
+    root = ipfs_dir({'file': ipfs_file(content, chunker='size-65536')})
+
+    for remount in [False, True]:
+        with ipfs_mounted(
+            root, ipfs_client,
+            disk_cache_dir=str(tmp_path),
+        ) as mountpoint:
+            with open(os.path.join(mountpoint, 'file'), 'rb') as f:
+                with request_count_measurement(ipfs_client) as mocked_request:
+                    assert f.read() == content
+                    if remount:
+                        assert mocked_request.call_count == 0
+                    else:
+                        assert mocked_request.call_count > 0
@@ -0,0 +1,27 @@
+import os
+
+from tools import ipfs_client, ipfs_dir, ipfs_file
+
+from ipfs_api_mount.ipfs import CachedIPFS
+from ipfs_api_mount.prefetch import Prefetcher
+
+
+def test_prefetch_metadata():
+    files = {str(i): ipfs_file(os.urandom(100)) for i in range(20)}
+    root = ipfs_dir({'dir': ipfs_dir(files), 'file': ipfs_file(b'x')})
+
+    ipfs = CachedIPFS(ipfs_client)
+    progress = Prefetcher(ipfs, mode='metadata').run(root)
+    assert (progress.dirs, progress.files, progress.bytes, progress.errors) == (2, 21, 0, 0)
+    for cid in files.values():
+        assert ipfs.has_attrs(cid)
+
+
+def test_prefetch_data_budget(tmp_path):
+    content = os.urandom(4096)
+    root = ipfs_dir({str(i): ipfs_file(content + bytes([i]), chunker='size-1024') for i in range(4)})
+
+    ipfs = CachedIPFS(ipfs_client, disk_cache_dir=str(tmp_path))
+    progress = Prefetcher(ipfs, mode='data', max_bytes=3 * 4097).run(root)
+    assert (progress.files, progress.skipped_files, progress.bytes) == (4, 1, 3 * 4097)
+    assert len(ipfs.disk_cache) > 3 * 5  # file roots and their chunks
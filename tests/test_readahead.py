@@ -0,0 +1,37 @@
+from unittest import mock
+
+import pytest
+
+from ipfs_api_mount.fuse_operations.high import (BaseIPFSOperations,
+                                                 IPFSFileHandle)
+
+
+def scheduled(operations, reads):
+    """ Ranges scheduled for read-ahead by given `(offset, size)` reads of a big file. """
+    file_handle = IPFSFileHandle(cid='QmFile')
+    with mock.patch('trio.lowlevel.spawn_system_task') as spawn:
+        for offset, size in reads:
+            operations.schedule_readahead(file_handle, offset, size, offset + size)
+    return [call.args[2:] for call in spawn.call_args_list]
+
+
+@pytest.mark.parametrize('read_ahead', [0, 1024 * 1024])
+def test_random_reads(read_ahead):
+    operations = BaseIPFSOperations(None, read_ahead=read_ahead)
+    assert scheduled(operations, [(40960, 4096), (0, 4096), (81920, 4096), (8192, 4096)]) == []
+
+
+def test_disabled():
+    operations = BaseIPFSOperations(None, read_ahead=0)
+    assert scheduled(operations, [(i * 4096, 4096) for i in range(4)]) == []
+
+
+def test_sequential_reads():
+    operations = BaseIPFSOperations(None, read_ahead=64 * 1024)
+    # window doubles with every read, ranges follow each other without overlap
+    assert scheduled(operations, [(i * 4096, 4096) for i in range(4)]) == [
+        (4096, 8192),
+        (12288, 12288),
+        (24576, 20480),
+        (45056, 36864),
+    ]
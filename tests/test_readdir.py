@@ -0,0 +1,60 @@
+import hashlib
+from unittest import mock
+
+import pyfuse3
+import trio
+
+from ipfs_api_mount.cid import cid_to_str
+from ipfs_api_mount.fuse_operations import IPFSOperations
+
+ROOT = 'QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn'
+# sharded directories are listed in order of hashes, not names
+NAMES = ['d', 'a', 'e', 'c', 'b']
+
+
+def file_link(name):
+    cid = cid_to_str(b'\x12\x20' + hashlib.sha256(name.encode()).digest())
+    return {'Name': name, 'Hash': cid, 'Type': 2, 'Size': 1}
+
+
+def operations():
+    client = mock.Mock()
+    client.resolve.return_value = {'Path': f'/ipfs/{ROOT}'}
+    client.block.get.return_value = bytes.fromhex('0a020801')  # unixfs directory
+    client.ls.side_effect = lambda *args, **kwargs: iter([
+        {'Objects': [{'Links': [file_link(name) for name in NAMES]}]},
+    ])
+    return IPFSOperations(ROOT, client, retries=0)
+
+
+async def readdir(ops, fh, start_id, limit=None):
+    """ Get `[(name, next_id)]` replied to one `readdir` call. """
+    replies = []
+
+    def readdir_reply(token, name, attrs, next_id):
+        if len(replies) == limit:
+            return False
+        replies.append((name.decode(), next_id))
+        return True
+
+    with mock.patch('pyfuse3.readdir_reply', readdir_reply):
+        await ops.readdir(fh, start_id, None)
+    return replies
+
+
+def test_rewind_keeps_offsets():
+    async def main():
+        ops = operations()
+        fh = await ops.opendir(pyfuse3.ROOT_INODE, None)
+        first = await readdir(ops, fh, 0, limit=2)
+        assert first == [('d', 1), ('a', 2)]
+        rest = await readdir(ops, fh, 2)
+        assert rest == [('e', 3), ('c', 4), ('b', 5)]
+
+        # the listing is cached now, seeking back must give the same entries
+        assert await readdir(ops, fh, 1, limit=2) == [('a', 2), ('e', 3)]
+        other_fh = await ops.opendir(pyfuse3.ROOT_INODE, None)
+        assert await readdir(ops, other_fh, 0) == first + rest
+        assert ops.ipfs.client.ls.call_count == 1
+
+    trio.run(main)
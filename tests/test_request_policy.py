@@ -0,0 +1,78 @@
+import threading
+import time
+
+import ipfshttpclient
+import pytest
+
+from ipfs_api_mount.metrics import Metrics
+from ipfs_api_mount.request_policy import HEDGE_MIN_SAMPLES, RequestPolicy
+
+
+def flaky(failures):
+    """ Request function failing given number of times. """
+    calls = []
+
+    def fn(arg, timeout):
+        calls.append(timeout)
+        if len(calls) <= failures:
+            raise ipfshttpclient.exceptions.TimeoutError(None)
+        return arg
+    return fn, calls
+
+
+def test_retries():
+    metrics = Metrics()
+    policy = RequestPolicy(metrics, timeout=1.0, timeouts={'block/get': 0.5}, retries=2, retry_backoff=0)
+
+    fn, calls = flaky(2)
+    assert policy.request('block/get', fn, 'a') == 'a'
+    assert calls == [pytest.approx(0.5, abs=0.05)] * 3
+    assert metrics.request_retries['block/get'] == 2
+    assert metrics.request_errors['block/get'] == 2
+
+    fn, calls = flaky(3)
+    with pytest.raises(ipfshttpclient.exceptions.TimeoutError):
+        policy.request('resolve', fn, 'a')
+    assert calls == [pytest.approx(1.0, abs=0.05)] * 3
+
+
+def test_retries_within_timeout():
+    policy = RequestPolicy(Metrics(), timeout=0.3, retries=5, retry_backoff=0)
+    calls = []
+
+    def fn(arg, timeout):
+        calls.append(timeout)
+        time.sleep(0.2)
+        raise ipfshttpclient.exceptions.TimeoutError(None)
+
+    start = time.monotonic()
+    with pytest.raises(ipfshttpclient.exceptions.TimeoutError):
+        policy.request('block/get', fn, 'a')
+    assert time.monotonic() - start < 0.5
+    assert calls == [pytest.approx(0.3, abs=0.05), pytest.approx(0.1, abs=0.05)]
+
+
+def test_hedging():
+    metrics = Metrics()
+    policy = RequestPolicy(metrics, hedge_quantile=0.9)
+    for _ in range(HEDGE_MIN_SAMPLES):
+        metrics.requests['block/get'].observe(0.001)
+
+    # the first request hangs, its duplicate answers
+    release = threading.Event()
+    calls = []
+
+    def fn(arg, timeout):
+        calls.append(arg)
+        if len(calls) == 1:
+            release.wait()
+            return 'slow'
+        return 'fast'
+
+    try:
+        assert policy.request('block/get', fn, 'a') == 'fast'
+    finally:
+        release.set()
+    assert metrics.request_hedges['block/get'] == 1
+    assert metrics.request_hedge_wins['block/get'] == 1
+    assert 'hedges 1' in metrics.render_text()
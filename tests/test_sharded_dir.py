@@ -0,0 +1,36 @@
+import os
+from unittest import mock
+
+from tools import ipfs_client, ipfs_dir, ipfs_file, ipfs_hamt_dir
+
+from ipfs_api_mount.ipfs import CachedIPFS
+
+
+def test_sharded_dir_lookup():
+    """ Entries of sharded dir are found locally, without resolving paths in the daemon. """
+    entries = {f'file{i}': ipfs_file(f'content {i}'.encode()) for i in range(100)}
+    root = ipfs_hamt_dir(entries)
+    for name, cid in entries.items():
+        # the daemon agrees on where the entries are
+        assert ipfs_client.resolve(f'/ipfs/{root}/{name}')['Path'] == f'/ipfs/{cid}'
+
+    ipfs = CachedIPFS(ipfs_client)
+    with mock.patch.object(ipfs_client, 'resolve') as resolve:
+        for name, cid in entries.items():
+            assert ipfs.child_cid(root, name) == cid
+        assert ipfs.child_cid(root, 'nonexistent') is None
+        resolve.assert_not_called()
+
+
+def test_sharded_dir_read(ipfs_mounted):
+    entries = {f'file{i}': ipfs_file(f'content {i}'.encode()) for i in range(100)}
+    root = ipfs_dir({'sharded': ipfs_hamt_dir(entries)})
+    with ipfs_mounted(
+        root, ipfs_client,
+    ) as mountpoint:
+        sharded = os.path.join(mountpoint, 'sharded')
+        assert sorted(os.listdir(sharded)) == sorted(entries)
+        for i in range(100):
+            with open(os.path.join(sharded, f'file{i}'), 'rb') as f:
+                assert f.read() == f'content {i}'.encode()
+        assert not os.path.exists(os.path.join(sharded, 'nonexistent'))
@@ -0,0 +1,37 @@
+from tools import ipfs_client, ipfs_dir, ipfs_file, request_count_measurement
+
+from ipfs_api_mount.ipfs import CachedIPFS
+from ipfs_api_mount.snapshot import is_immutable_path
+
+
+def test_snapshot(tmp_path):
+    """ Metadata saved in snapshot is served without requests after restart. """
+    files = {str(i): ipfs_file(f'content {i}'.encode()) for i in range(10)}
+    subdir = ipfs_dir({'a': ipfs_file(b'a')})
+    root = ipfs_dir({**files, 'subdir': subdir})
+    snapshot_path = str(tmp_path / 'snapshot')
+
+    ipfs = CachedIPFS(ipfs_client, snapshot_path=snapshot_path)
+    list(ipfs.ls_stream(root))
+    ipfs.cid_type(subdir)
+    ipfs.resolve(f'{subdir}/a')
+    ipfs.save_snapshot()
+
+    ipfs = CachedIPFS(ipfs_client, snapshot_path=snapshot_path)
+    with request_count_measurement(ipfs_client) as mocked:
+        assert sorted(entry.name for entry in ipfs.ls_stream(root)) == sorted([*files, 'subdir'])
+        assert ipfs.child_cid(root, '3') == files['3']
+        assert ipfs.cid_is_dir(subdir)
+        for cid in files.values():
+            assert ipfs.cid_is_file(cid)
+            assert ipfs.cid_size(cid) == len('content 0')
+        assert ipfs.resolve(f'{subdir}/a') is not None
+        assert mocked.call_count == 0
+
+
+def test_immutable_path():
+    cid = 'QmXKqqUymTQpEM89M15G23wot8g7n1qVYQQ6vVCpEofYSe'
+    assert is_immutable_path(cid)
+    assert is_immutable_path(f'/ipfs/{cid}/a/b')
+    assert not is_immutable_path('/ipns/example.com')
+    assert not is_immutable_path('k51qzi5uqu5dlvj2baxnqndepeb86cbk3ng7n3i46uzyxzyqj2xjonzllnv0v8')
@@ -1,7 +1,12 @@
+import io
 import tempfile
 from unittest import mock
 
 import ipfshttpclient
+import mmh3
+
+from ipfs_api_mount import merkledag_pb2, unixfs_pb2
+from ipfs_api_mount.cid import cid_from_str
 
 ipfs_client = ipfshttpclient.connect('/ip4/127.0.0.1/tcp/5001/http')
 
@@ -21,6 +26,40 @@ def ipfs_dir(contents):
     return node
 
 
+def ipfs_hamt_dir(contents, fanout=8):
+    """ Build sharded directory by hand - daemons shard directories only with experimental option enabled. """
+    bits = fanout.bit_length() - 1
+    prefix_length = len('{:X}'.format(fanout - 1))
+
+    def shard(entries, depth):
+        buckets = {}
+        for name, cid in entries:
+            hash_value = mmh3.hash64(name.encode(), signed=False)[0]
+            index = (hash_value >> (64 - bits * (depth + 1))) & (fanout - 1)
+            buckets.setdefault(index, []).append((name, cid))
+
+        node = merkledag_pb2.PBNode()
+        bitfield = 0
+        for index, bucket in sorted(buckets.items()):
+            bitfield |= 1 << index
+            prefix = '{:0{}X}'.format(index, prefix_length)
+            if len(bucket) == 1:
+                (name, cid), = bucket
+                node.Links.add(Name=prefix + name, Hash=cid_from_str(cid))
+            else:
+                node.Links.add(Name=prefix, Hash=cid_from_str(shard(bucket, depth + 1)))
+        node.Data = unixfs_pb2.Data(
+            Type=unixfs_pb2.Data.HAMTShard,
+            Data=bitfield.to_bytes(fanout // 8, 'big'),
+            hashType=0x22,  # murmur3-x64-64
+            fanout=fanout,
+        ).SerializeToString()
+        block = io.BytesIO(node.SerializeToString())
+        return ipfs_client.block.put(block, opts={'format': 'protobuf'})['Key']
+
+    return shard(contents.items(), 0)
+
+
 def request_count_measurement(client):
     return mock.patch.object(
         ipfshttpclient.http._backend.ClientSync,